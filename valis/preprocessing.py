@@ -8,6 +8,8 @@ import cv2
 from skimage import color as skcolor
 import pyvips
 import colour
+import numba as nba
+from numba import prange
 from scipy import ndimage
 
 from . import slide_io
@@ -17,6 +19,74 @@ from . import warp_tools
 DEFAULT_COLOR_STD_C = 0.2 # cam16-ucs
 
 
+@nba.njit(fastmath=True)
+def rescale_img_u8(img):
+    """Rescale image to fill the uint8 range
+
+    Fused version of `exposure.rescale_intensity(img, out_range=(0, 255)).astype(np.uint8)`
+    that avoids the float64 temporaries by finding the min/max in one
+    pass and writing the uint8 output in a second.
+
+    Deliberately not `parallel=True`: this gets called from worker
+    threads, and concurrent entry into a parallel numba kernel isn't
+    safe on the workqueue threading layer.
+
+    """
+    h, w = img.shape
+    vmin = img[0, 0]
+    vmax = img[0, 0]
+    for i in range(h):
+        for j in range(w):
+            v = img[i, j]
+            vmin = min(vmin, v)
+            vmax = max(vmax, v)
+
+    if vmax > vmin:
+        scale = 255.0/(vmax - vmin)
+    else:
+        scale = 0.0
+
+    out = np.empty((h, w), dtype=np.uint8)
+    for i in range(h):
+        for j in range(w):
+            out[i, j] = np.uint8((img[i, j] - vmin)*scale)
+
+    return out
+
+
+def rescale_u8_lut(img):
+    """Rescale a uint8 image to fill the uint8 range using a lookup table
+
+    With only 256 possible input values, the linear rescale can be
+    precomputed once and applied with `cv2.LUT`, avoiding the per-pixel
+    floating point work done by `exposure.rescale_intensity`.
+
+    """
+    vmin = int(img.min())
+    vmax = int(img.max())
+    scale = 255.0/max(vmax - vmin, 1)
+    lut = np.clip((np.arange(256) - vmin)*scale, 0, 255).astype(np.uint8)
+
+    return cv2.LUT(img, lut)
+
+
+def maybe_rescale_to_u8(img):
+    """Rescale image to fill the uint8 range, skipping images that already do
+
+    A uint8 image whose values already span [0, 255] comes back unchanged
+    and uncopied, since rescaling it is the identity. Other uint8 images
+    are rescaled with a 256-entry lookup table, and everything else goes
+    through `rescale_img_u8`.
+
+    """
+    if img.dtype == np.uint8:
+        if int(img.min()) == 0 and int(img.max()) == 255:
+            return img
+        return rescale_u8_lut(np.ascontiguousarray(img))
+
+    return rescale_img_u8(np.ascontiguousarray(img))
+
+
 class ImageProcesser(object):
     """Process images for registration
 
@@ -418,6 +488,112 @@ def combine_masks_by_hysteresis(mask_list):
     return hyst_mask
 
 
+@nba.njit()
+def hysteresis_threshold_and_fill(img, low, high):
+    """Hysteresis threshold an image and fill holes in a single pass
+
+    Fused version of `255*filters.apply_hysteresis_threshold(img, low, high)`
+    followed by `ndimage.binary_fill_holes`, which would each scan the
+    full image. Foreground is grown from seeds `>= high` through pixels
+    `>= low`, and holes are found by flooding the background from the
+    image borders.
+
+    """
+    h, w = img.shape
+    flat_img = img.reshape(-1)
+
+    # 0 = unknown, 1 = foreground, 2 = background reachable from border
+    labels = np.zeros(h*w, dtype=np.uint8)
+    stack = np.empty(h*w, dtype=np.int64)
+
+    # Seed with confident foreground
+    n = 0
+    for idx in range(h*w):
+        if flat_img[idx] >= high:
+            labels[idx] = 1
+            stack[n] = idx
+            n += 1
+
+    # Grow foreground through pixels above the low threshold
+    while n > 0:
+        n -= 1
+        idx = stack[n]
+        r = idx // w
+        c = idx % w
+        if r > 0 and labels[idx - w] == 0 and flat_img[idx - w] >= low:
+            labels[idx - w] = 1
+            stack[n] = idx - w
+            n += 1
+        if r < h - 1 and labels[idx + w] == 0 and flat_img[idx + w] >= low:
+            labels[idx + w] = 1
+            stack[n] = idx + w
+            n += 1
+        if c > 0 and labels[idx - 1] == 0 and flat_img[idx - 1] >= low:
+            labels[idx - 1] = 1
+            stack[n] = idx - 1
+            n += 1
+        if c < w - 1 and labels[idx + 1] == 0 and flat_img[idx + 1] >= low:
+            labels[idx + 1] = 1
+            stack[n] = idx + 1
+            n += 1
+
+    # Flood background from the borders. Anything it can't reach is a
+    # hole inside the foreground
+    n = 0
+    for c in range(w):
+        if labels[c] == 0:
+            labels[c] = 2
+            stack[n] = c
+            n += 1
+        idx = (h - 1)*w + c
+        if labels[idx] == 0:
+            labels[idx] = 2
+            stack[n] = idx
+            n += 1
+
+    for r in range(h):
+        idx = r*w
+        if labels[idx] == 0:
+            labels[idx] = 2
+            stack[n] = idx
+            n += 1
+        idx = r*w + w - 1
+        if labels[idx] == 0:
+            labels[idx] = 2
+            stack[n] = idx
+            n += 1
+
+    while n > 0:
+        n -= 1
+        idx = stack[n]
+        r = idx // w
+        c = idx % w
+        if r > 0 and labels[idx - w] == 0:
+            labels[idx - w] = 2
+            stack[n] = idx - w
+            n += 1
+        if r < h - 1 and labels[idx + w] == 0:
+            labels[idx + w] = 2
+            stack[n] = idx + w
+            n += 1
+        if c > 0 and labels[idx - 1] == 0:
+            labels[idx - 1] = 2
+            stack[n] = idx - 1
+            n += 1
+        if c < w - 1 and labels[idx + 1] == 0:
+            labels[idx + 1] = 2
+            stack[n] = idx + 1
+            n += 1
+
+    filled_mask = np.zeros((h, w), dtype=np.uint8)
+    flat_mask = filled_mask.reshape(-1)
+    for idx in range(h*w):
+        if labels[idx] != 2:
+            flat_mask[idx] = 255
+
+    return filled_mask
+
+
 def combine_masks(mask1, mask2, op="or"):
     if not isinstance(mask1, pyvips.Image):
         vmask1 = warp_tools.numpy2vips(mask1)
@@ -635,6 +811,54 @@ def mask2contours(mask, kernel_size=3):
     return contour_mask
 
 
+def calculate_cdf(histogram):
+    """
+    This method calculates the cumulative distribution function
+    :param array histogram: The values of the histogram
+    :return: normalized_cdf: The normalized cumulative distribution function
+    :rtype: array
+    """
+    # Get the cumulative sum of the elements
+    cdf = histogram.cumsum()
+
+    # Normalize the cdf
+    normalized_cdf = cdf / float(cdf.max())
+
+    return normalized_cdf
+
+
+def calculate_lookup(src_cdf, ref_cdf):
+    """
+    This method creates the lookup table
+    :param array src_cdf: The cdf for the source image
+    :param array ref_cdf: The cdf for the reference image
+    :return: lookup_table: The lookup table
+    :rtype: array
+    """
+    # For each source value, find the first reference value whose
+    # cdf is >= the source cdf. searchsorted does this in one
+    # vectorized binary search instead of a nested Python loop
+    lookup_table = np.searchsorted(ref_cdf, src_cdf, side="left")
+    lookup_table = np.clip(lookup_table, 0, len(ref_cdf) - 1).astype(float)
+
+    return lookup_table
+
+
+def get_matching_lut(src_histogram, ref_histogram):
+    """Build the lookup table that matches `src_histogram` to `ref_histogram`
+
+    :param array src_histogram: 256 bin histogram of the source image
+    :param array ref_histogram: 256 bin histogram of the reference signal
+    :return: lookup_table: Table mapping source values to reference values
+    :rtype: array
+    """
+    src_cdf = calculate_cdf(src_histogram)
+    ref_cdf = calculate_cdf(ref_histogram)
+    lookup_table = calculate_lookup(src_cdf, ref_cdf)
+
+    return lookup_table
+
+
 def match_histograms(src_image, ref_histogram, bins=256):
     """
     Source: https://automaticaddison.com/how-to-do-histogram-matching-using-opencv/
@@ -647,49 +871,12 @@ def match_histograms(src_image, ref_histogram, bins=256):
     :return: image_after_matching
     :rtype: image (array)
     """
-    def calculate_cdf(histogram):
-        """
-        This method calculates the cumulative distribution function
-        :param array histogram: The values of the histogram
-        :return: normalized_cdf: The normalized cumulative distribution function
-        :rtype: array
-        """
-        # Get the cumulative sum of the elements
-        cdf = histogram.cumsum()
-
-        # Normalize the cdf
-        normalized_cdf = cdf / float(cdf.max())
-
-        return normalized_cdf
-
-    def calculate_lookup(src_cdf, ref_cdf):
-        """
-        This method creates the lookup table
-        :param array src_cdf: The cdf for the source image
-        :param array ref_cdf: The cdf for the reference image
-        :return: lookup_table: The lookup table
-        :rtype: array
-        """
-        lookup_table = np.zeros(256)
-        lookup_val = 0
-        for src_pixel_val in range(len(src_cdf)):
-            lookup_val
-            for ref_pixel_val in range(len(ref_cdf)):
-                if ref_cdf[ref_pixel_val] >= src_cdf[src_pixel_val]:
-                    lookup_val = ref_pixel_val
-                    break
-            lookup_table[src_pixel_val] = lookup_val
-        return lookup_table
 
     # Split the images into the different color channels
     src_hist,  _ = np.histogram(src_image.flatten(), bins)
 
-    # Compute the normalized cdf for the source and reference image
-    src_cdf = calculate_cdf(src_hist)
-    ref_cdf = calculate_cdf(ref_histogram)
-
     # Make a separate lookup table for each color
-    lookup_table = calculate_lookup(src_cdf, ref_cdf)
+    lookup_table = get_matching_lut(src_hist, ref_histogram)
 
     # Use the lookup function to transform the colors of the original
     # source image
@@ -710,6 +897,60 @@ def get_channel_stats(img):
     return np.array(img_stats)
 
 
+def get_channel_stats_from_histogram(histogram):
+    """Get channel stats from a 256 bin histogram
+
+    Same stats as `get_channel_stats`, but estimated from the
+    image's histogram instead of the full pixel array.
+
+    """
+    cdf = np.cumsum(histogram)
+    n_px = cdf[-1]
+    levels = np.arange(len(histogram))
+
+    img_stats = [None] * 5
+    img_stats[0] = levels[np.searchsorted(cdf, 0.01*n_px)]
+    img_stats[1] = levels[np.searchsorted(cdf, 0.05*n_px)]
+    img_stats[2] = np.dot(levels, histogram)/n_px
+    img_stats[3] = levels[np.searchsorted(cdf, 0.95*n_px)]
+    img_stats[4] = levels[np.searchsorted(cdf, 0.99*n_px)]
+
+    return np.array(img_stats, dtype=float)
+
+
+def get_stat_norm_lut(src_histogram, target_stats):
+    """Build lookup table that applies the same mapping as `norm_img_stats`
+
+    Fits the Akima spline used by `norm_img_stats`, but from the source
+    image's histogram, and evaluates it at each uint8 level so that the
+    normalization can be applied as a single lookup table.
+
+    """
+    src_stats_flat = get_channel_stats_from_histogram(src_histogram)
+
+    # Avoid duplicates and keep in ascending order
+    lower_knots = np.array([0])
+    upper_knots = np.array([300, 350, 400, 450])
+    src_stats_flat = np.hstack([lower_knots, src_stats_flat, upper_knots]).astype(float)
+    target_stats_flat = np.hstack([lower_knots, target_stats, upper_knots]).astype(float)
+
+    # Add epsilon to avoid duplicate values
+    eps = 10*np.finfo(float).resolution
+    eps_array = np.arange(len(src_stats_flat)) * eps
+    src_stats_flat = src_stats_flat + eps_array
+    target_stats_flat = target_stats_flat + eps_array
+
+    # Make sure src stats are in ascending order
+    src_order = np.argsort(src_stats_flat)
+    src_stats_flat = src_stats_flat[src_order]
+    target_stats_flat = target_stats_flat[src_order]
+
+    cs = Akima1DInterpolator(src_stats_flat, target_stats_flat)
+    lookup_table = np.clip(cs(np.arange(len(src_histogram))), 0, 255)
+
+    return lookup_table
+
+
 def norm_img_stats(img, target_stats, mask=None):
     """Normalize an image
 
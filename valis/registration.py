@@ -8,6 +8,12 @@ import os
 import shutil
 import numpy as np
 import pathlib
+import multiprocessing
+import threading
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from joblib import Parallel, delayed, parallel_backend
 from skimage import transform, exposure, filters
 from time import time
 import tqdm
@@ -68,6 +74,11 @@ DEFAULT_MAX_NON_RIGID_REG_SIZE = 3000
 TILER_THRESH_GB = 2
 DEFAULT_NR_TILE_WH = 512
 
+# Stored displacement fields are quantized to int16, with the largest
+# absolute displacement mapped to this value
+DXDY_QUANT_MAX = 32767.0
+
+
 # Rigid registration kwarg keys #
 AFFINE_OPTIMIZER_KEY = "affine_optimizer"
 TRANSFORMER_KEY = "transformer"
@@ -126,7 +137,8 @@ def load_registrar(src_f):
         Valis object used for registration
 
     """
-    registrar = pickle.load(open(src_f, 'rb'))
+    with open(src_f, 'rb') as f:
+        registrar = pickle.load(f)
 
     data_dir = registrar.data_dir
     read_data_dir = os.path.split(src_f)[0]
@@ -336,6 +348,7 @@ class Slide(object):
         self.processed_img = None
         self.rigid_reg_mask = None
         self.non_rigid_reg_mask = None # Created by combining rigid masks
+        self._slide_mask_cache = {} # Memoized warped+resized rigid_reg_mask. Cleared before pickling
         self.stack_idx = None
 
         self.aligned_slide_shape_rc = None
@@ -350,6 +363,8 @@ class Slide(object):
         self._fwd_dxdy_f = None
         self._bk_dxdy_np = None
         self._fwd_dxdy_np = None
+        self._bk_dxdy_scale = None
+        self._fwd_dxdy_scale = None
         self.processed_img_f = None
         self.rigid_reg_img_f = None
         self.non_rigid_reg_img_f = None
@@ -568,7 +583,7 @@ class Slide(object):
         n_digits = len(str(self.val_obj.size))
         stack_id = str.zfill(str(self.stack_idx), n_digits)
 
-        self.processed_img_f = os.path.join(self.val_obj.processed_dir, self.name + ".png")
+        self.processed_img_f = os.path.join(self.val_obj.processed_dir, self.name + ".tif")
         self.rigid_reg_img_f = os.path.join(self.val_obj.reg_dst_dir, f"{stack_id}_f{self.name}.png")
         self.non_rigid_reg_img_f = os.path.join(self.val_obj.non_rigid_dst_dir, f"{stack_id}_f{self.name}.png")
         if self.stored_dxdy:
@@ -585,21 +600,70 @@ class Slide(object):
     def get_bk_dxdy(self):
         if self.stored_dxdy:
             bk_dxdy_f, _ = self.get_displacement_f()
-            cropped_bk_dxdy = pyvips.Image.new_from_file(bk_dxdy_f)
+            cropped_bk_dxdy = self._load_stored_dxdy(bk_dxdy_f, getattr(self, "_bk_dxdy_scale", None))
             full_bk_dxdy = self.val_obj.pad_displacement(cropped_bk_dxdy,
                 self.val_obj._full_displacement_shape_rc,
                 self.val_obj._non_rigid_bbox)
 
             return full_bk_dxdy
         else:
-            return self._bk_dxdy_np
+            return self._unpack_dxdy(self._bk_dxdy_np)
+
+    def _load_stored_dxdy(self, dxdy_f, scale=None):
+        """Open a stored displacement tiff as a pyvips.Image
+
+        When the parent Valis object opted into memory-mapped
+        displacements, the file was written uncompressed and is wrapped
+        with `tifffile.memmap`, so pages are only faulted in as pyvips
+        reads them. Otherwise the LZW tiled tiff is opened with pyvips,
+        which decodes tiles on demand.
+
+        `scale` is the quantization factor applied when the field was
+        saved as int16; dividing it back out returns the float
+        displacements. Fields saved before quantization was added have
+        no scale and are returned as is.
+
+        """
+        if getattr(self.val_obj, "_dxdy_use_memmap", False):
+            # tifffile ships with scikit-image, so it's always available
+            import tifffile
+            dxdy = warp_tools.numpy2vips(tifffile.memmap(dxdy_f, mode="r"))
+        else:
+            dxdy = pyvips.Image.new_from_file(dxdy_f)
+
+        if scale is not None:
+            dxdy = (dxdy/scale).cast("float")
+
+        return dxdy
+
+    @staticmethod
+    def _pack_dxdy(dxdy):
+        """Store displacements as float16, which halves their memory and
+        pickle size. Slide displacements are at most a few hundred pixels,
+        so the lost precision is well under a pixel
+        """
+        if dxdy is None or isinstance(dxdy, pyvips.Image):
+            return dxdy
+
+        return np.asarray(dxdy).astype(np.float16, copy=False)
+
+    @staticmethod
+    def _unpack_dxdy(dxdy):
+        """Cast stored displacements back to float32, since pyvips and the
+        spline interpolators don't handle float16
+        """
+        if dxdy is not None and not isinstance(dxdy, pyvips.Image) and \
+           np.asarray(dxdy).dtype == np.float16:
+            return np.asarray(dxdy).astype(np.float32)
+
+        return dxdy
 
     def set_bk_dxdy(self, bk_dxdy):
         """
         Only set if an array
         """
         if not isinstance(bk_dxdy, pyvips.Image):
-            self._bk_dxdy_np = bk_dxdy
+            self._bk_dxdy_np = self._pack_dxdy(bk_dxdy)
         else:
             print(f"Cannot set bk_dxdy when data is type {type(bk_dxdy)}")
 
@@ -610,7 +674,7 @@ class Slide(object):
     def get_fwd_dxdy(self):
         if self.stored_dxdy:
             _, fwd_dxdy_f = self.get_displacement_f()
-            cropped_fwd_dxdy = pyvips.Image.new_from_file(fwd_dxdy_f)
+            cropped_fwd_dxdy = self._load_stored_dxdy(fwd_dxdy_f, getattr(self, "_fwd_dxdy_scale", None))
             full_fwd_dxdy = self.val_obj.pad_displacement(cropped_fwd_dxdy,
                 self.val_obj._full_displacement_shape_rc,
                 self.val_obj._non_rigid_bbox)
@@ -618,11 +682,11 @@ class Slide(object):
             return full_fwd_dxdy
 
         else:
-            return self._fwd_dxdy_np
+            return self._unpack_dxdy(self._fwd_dxdy_np)
 
     def set_fwd_dxdy(self, fwd_dxdy):
         if not isinstance(fwd_dxdy, pyvips.Image):
-            self._fwd_dxdy_np = fwd_dxdy
+            self._fwd_dxdy_np = self._pack_dxdy(fwd_dxdy)
         else:
             print(f"Cannot set fwd_dxdy when data is type {type(fwd_dxdy)}")
 
@@ -724,6 +788,54 @@ class Slide(object):
 
         return warped_img
 
+    def _get_resized_rigid_mask(self, full_out_shape, mask_bbox_xywh, non_rigid):
+        """Warp, resize, and crop `rigid_reg_mask`, memoizing the result
+
+        The warp -> numpy2vips -> resize -> crop chain gets repeated with
+        the same arguments when prepping images for non-rigid registration,
+        so the result is cached per argument combination. The cache holds
+        pyvips images and is cleared before the registrar is pickled.
+
+        Parameters
+        ----------
+        full_out_shape : (int, int)
+            Shape (row, col) the mask should have after being resized
+
+        mask_bbox_xywh : list, optional
+            Bounding box to crop the resized mask. If None, no cropping
+
+        non_rigid : bool
+            Whether or not to apply the non-rigid transformation
+
+        Returns
+        -------
+        slide_mask : pyvips.Image
+            Warped and resized copy of `rigid_reg_mask`
+
+        """
+
+        cache = getattr(self, "_slide_mask_cache", None)
+        if cache is None:
+            # Slide was unpickled from an older registrar
+            cache = self._slide_mask_cache = {}
+
+        if mask_bbox_xywh is not None:
+            bbox_key = tuple(float(v) for v in mask_bbox_xywh)
+        else:
+            bbox_key = None
+        key = (tuple(int(v) for v in full_out_shape), bbox_key, bool(non_rigid))
+
+        slide_mask = cache.get(key)
+        if slide_mask is None:
+            temp_mask = self.warp_img(self.rigid_reg_mask, non_rigid=non_rigid, crop=False, interp_method="nearest")
+            temp_mask = warp_tools.numpy2vips(temp_mask)
+            slide_mask = warp_tools.resize_img(temp_mask, full_out_shape, interp_method="nearest")
+            if mask_bbox_xywh is not None:
+                slide_mask = warp_tools.crop_img(slide_mask, mask_bbox_xywh)
+
+            cache[key] = slide_mask
+
+        return slide_mask
 
     def warp_img_from_to(self, img, to_slide_obj,
                         dst_slide_level=0, non_rigid=True, interp_method="bicubic", bg_color=None):
@@ -860,8 +972,11 @@ class Slide(object):
 
         if src_f == self.src_f:
             bg_color = self.bg_color
+            # Reuse this slide's reader instead of building a new one
+            reader = self.reader
         else:
             bg_color = None
+            reader = None
 
         warped_slide = slide_tools.warp_slide(src_f, M=self.M,
                                               transformation_src_shape_rc=self.processed_img_shape_rc,
@@ -870,7 +985,8 @@ class Slide(object):
                                               dxdy=bk_dxdy, level=level, series=self.series,
                                               interp_method=interp_method,
                                               bbox_xywh=slide_bbox_xywh,
-                                              bg_color=bg_color)
+                                              bg_color=bg_color,
+                                              reader=reader)
         return warped_slide
 
     @valtils.deprecated_args(perceputally_uniform_channel_colors="colormap")
@@ -1896,6 +2012,24 @@ class Valis(object):
 
         self.has_rounds = False
         self.norm_method = norm_method
+
+        # Opt-in: save stored displacements uncompressed so they can be
+        # memory-mapped on reload, trading disk space for open time
+        self._dxdy_use_memmap = False
+
+        # Format of the micro-registration QC thumbnails. "jpg" encodes
+        # several times faster than "png" at similar visual quality
+        self.thumbnail_format = "png"
+
+        # Opt-in: when set to an int, warp_and_merge_slides writes groups
+        # of this many channels to disk-backed temp images so the final
+        # save doesn't keep every slide's warp pipeline open at once.
+        # Disabled by default, since the temp images are uncompressed and
+        # full resolution, which can mean a lot of temp disk at level 0
+        self._merge_checkpoint_nbands = None
+
+        # Memoized results of get_aligned_slide_shape
+        self._aligned_shape_cache = {}
         self.summary_df = None
         self.start_time = None
         self.end_rigid_time = None
@@ -2032,9 +2166,9 @@ class Valis(object):
             reader = reader_cls(f, series=series)
 
             slide_dims = reader.metadata.slide_dimensions
-            levels_in_range = np.where(slide_dims.max(axis=1) < self.max_image_dim_px)[0]
-            if len(levels_in_range) > 0:
-                level = levels_in_range[0]
+            levels_in_range = slide_dims.max(axis=1) < self.max_image_dim_px
+            if levels_in_range.any():
+                level = int(np.argmax(levels_in_range))
             else:
                 level = len(slide_dims) - 1
 
@@ -2074,8 +2208,22 @@ class Valis(object):
             else:
                 self.image_type = unique_img_types[0]
 
+        self._cache_slide_arrays()
         self.check_img_max_dims()
 
+    def _cache_slide_arrays(self):
+        """Cache per-slide metadata in parallel numpy arrays
+
+        Cross-slide reductions (e.g. shape maxima) can then be done as
+        single vectorized operations instead of walking `slide_dict`
+        and each Slide's attributes.
+
+        """
+        slide_objs = list(self.slide_dict.values())
+        self._slide_names = np.array([slide_obj.name for slide_obj in slide_objs])
+        self._slide_img_types = np.array([slide_obj.img_type for slide_obj in slide_objs])
+        self._slide_img_shapes_rc = np.array([slide_obj.image.shape[0:2] for slide_obj in slide_objs])
+
     def check_img_max_dims(self):
         """Ensure that all images have similar sizes.
 
@@ -2084,7 +2232,7 @@ class Valis(object):
 
         """
 
-        og_img_sizes_wh = np.array([slide_obj.image.shape[0:2][::-1] for slide_obj in self.slide_dict.values()])
+        og_img_sizes_wh = self._slide_img_shapes_rc[:, ::-1]
         img_max_dims = og_img_sizes_wh.max(axis=1)
         min_max_wh = img_max_dims.min()
         scaling_for_og_imgs = min_max_wh/img_max_dims
@@ -2100,6 +2248,9 @@ class Valis(object):
                 if scaling < 1:
                     slide_obj.image =  warp_tools.rescale_img(slide_obj.image, scaling)
 
+            # Image shapes changed, so refresh the cached arrays
+            self._cache_slide_arrays()
+
         if self.max_processed_image_dim_px > self.max_image_dim_px:
             msg = f"parameter max_processed_image_dim_px also being updated to {self.max_image_dim_px}"
             valtils.print_warning(msg)
@@ -2191,94 +2342,127 @@ class Valis(object):
         """
 
         pathlib.Path(self.processed_dir).mkdir(exist_ok=True, parents=True)
-        if self.norm_method is not None:
-            if self.norm_method == "histo_match":
-                ref_histogram = np.zeros(256, dtype=np.int)
-            else:
-                all_v = [None]*self.size
+        if self.create_masks:
+            pathlib.Path(self.mask_dir).mkdir(exist_ok=True, parents=True)
+
+        # Each slide is processed independently, so spread the work
+        # across threads and reduce the histograms afterwards
+        pbar = tqdm.tqdm(total=self.size)
+
+        def process_one_slide(slide_obj):
+            img_hist = self._process_one_slide(slide_obj,
+                                               brightfield_processing_cls,
+                                               brightfield_processing_kwargs,
+                                               if_processing_cls,
+                                               if_processing_kwargs)
+            pbar.update(1)
+            return img_hist
+
+        n_cpu = multiprocessing.cpu_count() - 1
+        with parallel_backend("threading", n_jobs=n_cpu):
+            all_hists = Parallel()(delayed(process_one_slide)(slide_obj) for
+                                   slide_obj in self.slide_dict.values())
+        pbar.close()
 
-        for i, slide_obj in enumerate(tqdm.tqdm(self.slide_dict.values())):
-            is_ihc = slide_obj.img_type == slide_tools.IHC_NAME
-            if is_ihc:
-                processing_cls = brightfield_processing_cls
-                processing_kwargs = brightfield_processing_kwargs
+        if self.norm_method is not None:
+            ref_histogram = np.sum(all_hists, axis=0, dtype=np.uint32)
+            # Pooled histogram summarizes all images, so the stats for
+            # "img_stats" can be drawn from it instead of concatenating
+            # every image's pixels
+            target_stats = ref_histogram
+            self.normalize_images(target_stats)
 
-            else:
-                processing_cls = if_processing_cls
-                processing_kwargs = if_processing_kwargs
+    def _process_one_slide(self, slide_obj, brightfield_processing_cls,
+                           brightfield_processing_kwargs, if_processing_cls,
+                           if_processing_kwargs):
+        """Process a single slide's image for rigid registration
 
-            levels_in_range = np.where(slide_obj.slide_dimensions_wh.max(axis=1) < self.max_processed_image_dim_px)[0]
-            if len(levels_in_range) > 0:
-                level = levels_in_range[0]
-            else:
-                level = len(slide_obj.slide_dimensions_wh) - 1
-            processor = processing_cls(image=slide_obj.image, src_f=slide_obj.src_f, level=level, series=slide_obj.series)
+        Returns
+        -------
+        img_hist : ndarray, optional
+            256 bin histogram of the processed image, if images
+            will be normalized. Otherwise None.
 
-            try:
-                processed_img = processor.process_image(**processing_kwargs)
-            except TypeError:
-                # processor.process_image doesn't take kwargs
-                processed_img = processor.process_image()
+        """
+        is_ihc = slide_obj.img_type == slide_tools.IHC_NAME
+        if is_ihc:
+            processing_cls = brightfield_processing_cls
+            processing_kwargs = brightfield_processing_kwargs
 
-            processed_img = exposure.rescale_intensity(processed_img, out_range=(0, 255)).astype(np.uint8)
-            scaling = np.min(self.max_processed_image_dim_px/np.array(processed_img.shape[0:2]))
-            if scaling < 1:
-                processed_img = warp_tools.rescale_img(processed_img, scaling)
+        else:
+            processing_cls = if_processing_cls
+            processing_kwargs = if_processing_kwargs
+
+        # argmax short-circuits at the first level in range, without
+        # materializing an index array like np.where
+        levels_in_range = slide_obj.slide_dimensions_wh.max(axis=1) < self.max_processed_image_dim_px
+        if levels_in_range.any():
+            level = int(np.argmax(levels_in_range))
+        else:
+            level = len(slide_obj.slide_dimensions_wh) - 1
+        processor = processing_cls(image=slide_obj.image, src_f=slide_obj.src_f, level=level, series=slide_obj.series)
 
-            if self.create_masks:
-                # Get masks #
-                pathlib.Path(self.mask_dir).mkdir(exist_ok=True, parents=True)
+        try:
+            processed_img = processor.process_image(**processing_kwargs)
+        except TypeError:
+            # processor.process_image doesn't take kwargs
+            processed_img = processor.process_image()
 
-                # Slice region from slide and process too
-                mask = processor.create_mask()
-                if not np.all(mask.shape == processed_img.shape[0:2]):
-                    mask = warp_tools.resize_img(mask, processed_img.shape[0:2], interp_method="nearest")
+        processed_img = preprocessing.rescale_img_u8(np.ascontiguousarray(processed_img))
+        scaling = np.min(self.max_processed_image_dim_px/np.array(processed_img.shape[0:2]))
+        if scaling < 1:
+            processed_img = warp_tools.rescale_img(processed_img, scaling)
 
-                slide_obj.rigid_reg_mask = mask
-                processed_img[mask == 0] = 0
+        if self.create_masks:
+            # Slice region from slide and process too
+            mask = processor.create_mask()
+            if not np.all(mask.shape == processed_img.shape[0:2]):
+                mask = warp_tools.resize_img(mask, processed_img.shape[0:2], interp_method="nearest")
 
-                # Save image with mask drawn on top of it
-                thumbnail_mask = self.create_thumbnail(mask)
-                if slide_obj.img_type == slide_tools.IHC_NAME:
-                    thumbnail_img = self.create_thumbnail(slide_obj.image)
-                else:
-                    thumbnail_img = self.create_thumbnail(processed_img)
+            slide_obj.rigid_reg_mask = mask
 
-                thumbnail_mask_outline = viz.draw_outline(thumbnail_img, thumbnail_mask)
-                outline_f_out = os.path.join(self.mask_dir, f'{slide_obj.name}.png')
-                warp_tools.save_img(outline_f_out, thumbnail_mask_outline)
+            # Multiplying by the 0/1 mask zeroes the background in one
+            # streaming pass, instead of a boolean-indexed scatter write
+            np.multiply(processed_img, (mask > 0).view(np.uint8), out=processed_img)
 
+            # Save image with mask drawn on top of it
+            thumbnail_mask = self.create_thumbnail(mask)
+            if slide_obj.img_type == slide_tools.IHC_NAME:
+                thumbnail_img = self.create_thumbnail(slide_obj.image)
             else:
-                mask = np.full(processed_img.shape, 255, dtype=np.uint8)
+                thumbnail_img = self.create_thumbnail(processed_img)
 
-            slide_obj.rigid_reg_mask = mask
-            slide_obj.processed_img = processed_img
+            thumbnail_mask_outline = viz.draw_outline(thumbnail_img, thumbnail_mask)
+            outline_f_out = os.path.join(self.mask_dir, f'{slide_obj.name}.png')
+            warp_tools.save_img(outline_f_out, thumbnail_mask_outline)
 
-            processed_f_out = os.path.join(self.processed_dir, slide_obj.name + ".png")
-            slide_obj.processed_img_f = processed_f_out
-            slide_obj.processed_img_shape_rc = np.array(processed_img.shape[0:2])
-            warp_tools.save_img(processed_f_out, processed_img)
+        else:
+            mask = np.full(processed_img.shape, 255, dtype=np.uint8)
 
-            img_for_stats = processed_img.reshape(-1)
+        slide_obj.rigid_reg_mask = mask
+        slide_obj.processed_img = processed_img
 
-            if self.norm_method is not None:
-                if self.norm_method == "histo_match":
-                    img_hist, _ = np.histogram(img_for_stats, bins=256)
-                    ref_histogram += img_hist
-                else:
-                    all_v[i] = img_for_stats.reshape(-1)
+        processed_f_out = os.path.join(self.processed_dir, slide_obj.name + ".tif")
+        slide_obj.processed_img_f = processed_f_out
+        slide_obj.processed_img_shape_rc = np.array(processed_img.shape[0:2])
+        warp_tools.save_img(processed_f_out, processed_img)
 
         if self.norm_method is not None:
-            if self.norm_method == "histo_match":
-                target_stats = ref_histogram
-            else:
-                all_v = np.hstack(all_v)
-                target_stats = all_v
+            # bincount skips np.histogram's bin-edge searches. uint32
+            # halves the accumulator bandwidth and is plenty for the
+            # total pixel count of the processed images
+            img_hist = np.bincount(processed_img.reshape(-1), minlength=256).astype(np.uint32)
+        else:
+            img_hist = None
 
-            self.normalize_images(target_stats)
+        return img_hist
 
     def denoise_images(self):
-        for i, slide_obj in enumerate(tqdm.tqdm(self.slide_dict.values())):
+        # Denoising each slide is independent and CPU heavy, so spread
+        # the slides across threads
+        pbar = tqdm.tqdm(total=self.size)
+
+        def denoise_one_slide(slide_obj):
             if slide_obj.rigid_reg_mask is None:
                 is_ihc = slide_obj.img_type == slide_tools.IHC_NAME
                 _, tissue_mask = preprocessing.create_tissue_mask(slide_obj.image, is_ihc)
@@ -2292,6 +2476,13 @@ class Valis(object):
 
             denoised = preprocessing.denoise_img(slide_obj.processed_img, mask=denoise_mask)
             warp_tools.save_img(slide_obj.processed_img_f, denoised)
+            pbar.update(1)
+
+        n_cpu = multiprocessing.cpu_count() - 1
+        with parallel_backend("threading", n_jobs=n_cpu):
+            Parallel()(delayed(denoise_one_slide)(slide_obj) for
+                       slide_obj in self.slide_dict.values())
+        pbar.close()
 
     def normalize_images(self, target):
         """Normalize intensity values in images
@@ -2299,32 +2490,77 @@ class Valis(object):
         Parameters
         ----------
         target : ndarray
-            Target statistics used to normalize images
+            Pooled 256 bin histogram of all processed images, used to
+            determine the target statistics each image is normalized to
 
         """
         print("\n==== Normalizing images\n")
-        for i, slide_obj in enumerate(tqdm.tqdm(self.slide_dict.values())):
-            vips_img = pyvips.Image.new_from_file(slide_obj.processed_img_f)
-            img = warp_tools.vips2numpy(vips_img)
-            if self.norm_method == "histo_match":
-                self.target_processing_stats = target
-                normed_img = preprocessing.match_histograms(img, self.target_processing_stats)
-            elif self.norm_method == "img_stats":
-                self.target_processing_stats = preprocessing.get_channel_stats(target)
-                normed_img = preprocessing.norm_img_stats(img, self.target_processing_stats)
 
-            normed_img = exposure.rescale_intensity(normed_img, out_range=(0, 255)).astype(np.uint8)
-            slide_obj.processed_img = normed_img
+        # Target stats are the same for every image, so compute them once
+        if self.norm_method == "histo_match":
+            self.target_processing_stats = target
+        elif self.norm_method == "img_stats":
+            self.target_processing_stats = preprocessing.get_channel_stats_from_histogram(target)
 
-            slide_obj.processed_img_shape_rc = np.array(normed_img.shape[0:2])
-            warp_tools.save_img(slide_obj.processed_img_f, normed_img)
+        # Load and histogram the next image in a background thread so
+        # decoding overlaps with building and applying the lookup table
+        prefetch_q = queue.Queue(maxsize=2)
+
+        def prefetch_imgs():
+            for slide_obj in self.slide_dict.values():
+                try:
+                    vips_img = pyvips.Image.new_from_file(slide_obj.processed_img_f)
+                    img_hist = warp_tools.vips2numpy(vips_img.hist_find()).reshape(-1)
+                except Exception as e:
+                    # Hand the error to the consumer, which would
+                    # otherwise block forever waiting on the queue
+                    prefetch_q.put(e)
+                    return
+                prefetch_q.put((slide_obj, vips_img, img_hist))
+
+        prefetch_thread = threading.Thread(target=prefetch_imgs, daemon=True)
+        prefetch_thread.start()
+
+        for i in tqdm.tqdm(range(self.size)):
+            fetched = prefetch_q.get()
+            if isinstance(fetched, Exception):
+                raise fetched
+            slide_obj, vips_img, img_hist = fetched
+            if self.norm_method == "histo_match":
+                lut = preprocessing.get_matching_lut(img_hist, self.target_processing_stats)
+            elif self.norm_method == "img_stats":
+                lut = preprocessing.get_stat_norm_lut(img_hist, self.target_processing_stats)
+
+            # Fold rescale_intensity into the lookup table, using only
+            # the values actually present in the image
+            present_v = lut[img_hist > 0]
+            vmin, vmax = present_v.min(), present_v.max()
+            if vmax > vmin:
+                lut = (lut - vmin) * (255.0/(vmax - vmin))
+            lut = np.clip(np.round(lut), 0, 255).astype(np.uint8)
+
+            # Apply the normalization as a single pyvips pass, but
+            # materialize the result before saving. The pipeline reads
+            # from processed_img_f, so saving the lazy image would
+            # truncate the file it is still pulling tiles from
+            vips_lut = warp_tools.numpy2vips(lut.reshape(1, -1))
+            normed_vips = vips_img.maplut(vips_lut)
+            slide_obj.processed_img = warp_tools.vips2numpy(normed_vips)
+            slide_obj.processed_img_shape_rc = np.array(slide_obj.processed_img.shape[0:2])
+            warp_tools.save_img(slide_obj.processed_img_f, slide_obj.processed_img)
+
+        prefetch_thread.join()
 
     def create_thumbnail(self, img, rescale_color=False):
         """Create thumbnail image to view results
         """
         scaling = np.min(self.thumbnail_size/np.array(img.shape[:2]))
         if scaling < 1:
-            thumbnail = warp_tools.rescale_img(img, scaling)
+            # thumbnail_image uses pyvips' fast shrink path, which can
+            # also read from a lower pyramid level when one is available
+            vips_img = warp_tools.numpy2vips(img)
+            target_w = max(1, int(round(scaling*img.shape[1])))
+            thumbnail = warp_tools.vips2numpy(vips_img.thumbnail_image(target_w))
         else:
             thumbnail = img
 
@@ -2337,7 +2573,13 @@ class Valis(object):
         """Create image showing the overlap of registered images
         """
 
-        composite_img = np.dstack(img_list)
+        # Fill a preallocated buffer instead of np.dstack, which would
+        # allocate and copy an extra full-size intermediate
+        img_shape_rc = img_list[0].shape[0:2]
+        composite_img = np.empty((*img_shape_rc, len(img_list)), dtype=img_list[0].dtype)
+        for i, img in enumerate(img_list):
+            composite_img[..., i] = img
+
         cmap = viz.jzazbz_cmap()
         channel_colors = viz.get_n_colors(cmap, composite_img.shape[2])
         overlap_img = viz.color_multichannel(composite_img, channel_colors,
@@ -2387,19 +2629,17 @@ class Valis(object):
         """
 
         ref_slide = rigid_registrar.img_obj_dict[valtils.get_name(self.reference_img_f)]
-        combo_mask = np.zeros(ref_slide.registered_shape_rc, dtype=int)
+        combo_mask = np.zeros(ref_slide.registered_shape_rc, dtype=np.int64)
         for img_obj in rigid_registrar.img_obj_list:
 
             img_mask = self.slide_dict[img_obj.name].rigid_reg_mask
-            warped_img_mask = warp_tools.warp_img(img_mask,
-                                                  M=img_obj.M,
-                                                  out_shape_rc=img_obj.registered_shape_rc,
-                                                  interp_method="nearest")
-
-            combo_mask[warped_img_mask > 0] += 1
+            # M already maps registered (dst) positions back to the
+            # source image, which is exactly the lookup the kernel does
+            warp_tools.warp_accumulate_mask(combo_mask,
+                                            np.ascontiguousarray(img_mask),
+                                            np.ascontiguousarray(img_obj.M))
 
-        temp_mask = 255*filters.apply_hysteresis_threshold(combo_mask, 0.5, self.size-0.5).astype(np.uint8)
-        mask = 255*ndimage.binary_fill_holes(temp_mask).astype(np.uint8)
+        mask = preprocessing.hysteresis_threshold_and_fill(combo_mask, 0.5, self.size-0.5)
         mask = preprocessing.mask2contours(mask)
 
         mask_bbox_xywh = warp_tools.xy2bbox(warp_tools.mask2xy(mask))
@@ -2694,18 +2934,19 @@ class Valis(object):
             slide_obj.xy_matched_to_prev = match_dict.matched_kp1_xy
             slide_obj.xy_in_prev = match_dict.matched_kp2_xy
 
-            # Get points in overlap box #
+            # Get points in overlap box. Combining the boolean masks
+            # avoids the sorts np.intersect1d would do on index arrays
             prev_kp_warped_for_bbox_test = warp_tools.warp_xy(slide_obj.xy_in_prev, M=slide_obj.M)
-            _, prev_kp_in_bbox_idx = \
-                warp_tools.get_pts_in_bbox(prev_kp_warped_for_bbox_test, overlap_mask_bbox_xywh)
+            prev_kp_in_bbox = \
+                warp_tools.get_pts_in_bbox_mask(prev_kp_warped_for_bbox_test, overlap_mask_bbox_xywh)
 
             current_kp_warped_for_bbox_test = \
                 warp_tools.warp_xy(slide_obj.xy_matched_to_prev, M=slide_obj.M)
 
-            _, current_kp_in_bbox_idx = \
-                warp_tools.get_pts_in_bbox(current_kp_warped_for_bbox_test, overlap_mask_bbox_xywh)
+            current_kp_in_bbox = \
+                warp_tools.get_pts_in_bbox_mask(current_kp_warped_for_bbox_test, overlap_mask_bbox_xywh)
 
-            matched_kp_in_bbox = np.intersect1d(prev_kp_in_bbox_idx, current_kp_in_bbox_idx)
+            matched_kp_in_bbox = prev_kp_in_bbox & current_kp_in_bbox
             slide_obj.xy_matched_to_prev_in_bbox =  slide_obj.xy_matched_to_prev[matched_kp_in_bbox]
             slide_obj.xy_in_prev_in_bbox = slide_obj.xy_in_prev[matched_kp_in_bbox]
 
@@ -2733,7 +2974,21 @@ class Valis(object):
             else:
                 img_to_warp = slide_obj.image
 
-            warped_img = slide_obj.warp_img(img_to_warp, non_rigid=False, crop=self.crop)
+            if not slide_obj.is_rgb and denoise:
+                # registered_img is already the uncropped rigid warp of
+                # this image, so crop it instead of warping a second time
+                crop_method = slide_obj.get_crop_method(self.crop)
+                if crop_method is not False:
+                    if crop_method == CROP_REF:
+                        scaled_shape_rc = ref_slide.processed_img_shape_rc
+                    else:
+                        scaled_shape_rc = slide_obj.reg_img_shape_rc
+                    bbox_xywh, _ = slide_obj.get_crop_xywh(crop_method, scaled_shape_rc)
+                    warped_img = warp_tools.crop_img(slide_reg_obj.registered_img, bbox_xywh)
+                else:
+                    warped_img = slide_reg_obj.registered_img
+            else:
+                warped_img = slide_obj.warp_img(img_to_warp, non_rigid=False, crop=self.crop)
             warp_tools.save_img(slide_obj.rigid_reg_img_f, warped_img.astype(np.uint8), thumbnail_size=self.thumbnail_size)
 
             # Replace processed image with a thumbnail #
@@ -2802,36 +3057,309 @@ class Valis(object):
 
         """
         
-        combo_mask = np.zeros(self.aligned_img_shape_rc, dtype=int)
-        for i, slide_obj in enumerate(self.slide_dict.values()):
-            rigid_mask = slide_obj.warp_img(slide_obj.rigid_reg_mask, non_rigid=False, crop=False, interp_method="nearest")
-            combo_mask[rigid_mask > 0] += 1
+        combo_mask = np.zeros(self.aligned_img_shape_rc, dtype=np.int64)
 
-        temp_non_rigid_mask = 255*filters.apply_hysteresis_threshold(combo_mask, 0.5, self.size-0.5).astype(np.uint8)
+        def warp_rigid_mask(slide_obj):
+            return slide_obj.warp_img(slide_obj.rigid_reg_mask, non_rigid=False, crop=False, interp_method="nearest")
+
+        # Warp the masks on a thread pool (pyvips releases the GIL) and
+        # accumulate serially as each one completes
+        n_cpu = multiprocessing.cpu_count() - 1
+        with ThreadPoolExecutor(max_workers=n_cpu) as executor:
+            for rigid_mask in executor.map(warp_rigid_mask, self.slide_dict.values()):
+                combo_mask[rigid_mask > 0] += 1
+
+        non_rigid_mask = preprocessing.hysteresis_threshold_and_fill(combo_mask, 0.5, self.size-0.5)
 
         # Draw convex hull around each region
-        non_rigid_mask = 255*ndimage.binary_fill_holes(temp_non_rigid_mask).astype(np.uint8)
         non_rigid_mask = preprocessing.mask2contours(non_rigid_mask)
 
         return non_rigid_mask
 
+    @staticmethod
+    def _pad_displacement_into(dst, dxdy, bbox_xywh):
+        """Insert `dxdy` into the preallocated array `dst` in-place
+
+        Only the strips outside the bounding box are zeroed, so each
+        element of `dst` is written exactly once. Avoids allocating and
+        zero-filling a throwaway full-sized array per displacement field.
+
+        """
+
+        x0, y0 = np.round(bbox_xywh[0:2]).astype(int)
+        h, w = dxdy[0].shape[0:2]
+
+        dst[:, :y0, :] = 0
+        dst[:, y0+h:, :] = 0
+        dst[:, y0:y0+h, :x0] = 0
+        dst[:, y0:y0+h, x0+w:] = 0
+        dst[:, y0:y0+h, x0:x0+w] = dxdy
+
+        return dst
+
     def pad_displacement(self, dxdy, out_shape_rc, bbox_xywh):
 
         is_array = not isinstance(dxdy, pyvips.Image)
         if is_array:
-            vips_dxdy = warp_tools.numpy2vips(np.dstack(dxdy))
-        else:
-            vips_dxdy = dxdy
+            # Insert directly into a preallocated array instead of
+            # round-tripping through pyvips, which would allocate both a
+            # vips and a numpy copy of the full displacement field
+            dxdy = np.asarray(dxdy)
+            full_dxdy = np.empty((2, out_shape_rc[0], out_shape_rc[1]), dtype=dxdy.dtype)
 
-        full_dxdy = pyvips.Image.black(out_shape_rc[1], out_shape_rc[0], bands=2).cast("float")
-        full_dxdy = full_dxdy.insert(vips_dxdy, *bbox_xywh[0:2])
+            return self._pad_displacement_into(full_dxdy, dxdy, bbox_xywh)
 
-        if is_array:
-            full_dxdy = warp_tools.vips2numpy(full_dxdy)
-            full_dxdy = np.array([full_dxdy[..., 0], full_dxdy[..., 1]])
+        # pyvips inputs stay lazy, so the full field is only computed
+        # when the final consumer requests pixels. embed zero-pads to the
+        # full shape in a single operator and keeps the input's format
+        full_dxdy = dxdy.embed(bbox_xywh[0], bbox_xywh[1],
+                               out_shape_rc[1], out_shape_rc[0],
+                               extend="black")
 
         return full_dxdy
 
+    def _thumbnail_to_shape(self, slide_obj, target_shape_rc, level):
+        """Read a slide scaled to `target_shape_rc`
+
+        If the image is file-backed and read directly by pyvips, use
+        `pyvips.Image.thumbnail` so the loader can shrink while decoding,
+        instead of decoding the full pyramid level and resizing afterwards.
+
+        Parameters
+        ----------
+        slide_obj : Slide
+            Slide to read
+
+        target_shape_rc : (int, int)
+            Shape (row, col) the image should have after being read
+
+        level : int
+            Pyramid level to read when pyvips can't shrink during decoding
+
+        Returns
+        -------
+        img : pyvips.Image
+            Image with shape `target_shape_rc`
+
+        """
+
+        can_shrink_on_load = type(slide_obj.reader) == slide_io.VipsSlideReader and \
+            not slide_obj.reader.is_ome and not slide_obj.reader.use_openslide
+
+        if can_shrink_on_load:
+            try:
+                return pyvips.Image.thumbnail(slide_obj.src_f, target_shape_rc[1],
+                                              height=target_shape_rc[0],
+                                              size="force", linear=False)
+            except pyvips.Error:
+                pass
+
+        vips_level_img = slide_obj.slide2vips(level)
+
+        return warp_tools.resize_img(vips_level_img, target_shape_rc)
+
+    def _process_image_tiled(self, vips_img, processing_cls, processing_kwargs,
+                             slide_obj, level, tile_wh=4096):
+        """Process a large warped image one tile at a time
+
+        Runs the image processor on `tile_wh` x `tile_wh` tiles so that only
+        one tile is held as a numpy array at a time. Each processed tile is
+        written to a disk-backed pyvips image, and the intensity rescaling
+        that would otherwise be done on the full numpy array is instead a
+        streaming pyvips pass over the assembled image.
+
+        Since the processor sees one tile at a time, processors that rely on
+        whole-image statistics may give slightly different results than they
+        would when given the full image.
+
+        Parameters
+        ----------
+        vips_img : pyvips.Image
+            Warped image to process
+
+        processing_cls : ImageProcesser
+            ImageProcesser used to process each tile
+
+        processing_kwargs : dict
+            Keyword arguments passed to `processing_cls.process_image`
+
+        slide_obj : Slide
+            Slide `vips_img` came from
+
+        level : int
+            Pyramid level `vips_img` was read from
+
+        tile_wh : int
+            Width and height of each tile
+
+        Returns
+        -------
+        processed_img : ndarray
+            Processed uint8 version of `vips_img`
+
+        """
+
+        tile_bboxes = warp_tools.get_grid_bboxes((vips_img.height, vips_img.width),
+                                                 tile_wh, tile_wh, inclusive=True)
+
+        processed = pyvips.Image.black(vips_img.width, vips_img.height).cast("float")
+        for bbox_xywh in tile_bboxes:
+            x, y, w, h = bbox_xywh
+            tile = warp_tools.vips2numpy(vips_img.extract_area(x, y, w, h))
+            processor = processing_cls(image=tile, src_f=slide_obj.src_f, level=level, series=slide_obj.series)
+            try:
+                processed_tile = processor.process_image(**processing_kwargs)
+            except TypeError:
+                # processor.process_image doesn't take kwargs
+                processed_tile = processor.process_image()
+
+            # Write each tile to a temp file so the numpy tile can be freed
+            tile_f = pyvips.Image.new_temp_file("%s.v")
+            warp_tools.numpy2vips(processed_tile.astype(np.float32)).write(tile_f)
+            processed = processed.insert(tile_f, x, y)
+
+        disk_img = pyvips.Image.new_temp_file("%s.v")
+        processed.write(disk_img)
+
+        # Same global rescaling done when processing the image whole, i.e.
+        # exposure.rescale_intensity(img, out_range=(0, 255)).astype(np.uint8)
+        vmin, vmax = disk_img.min(), disk_img.max()
+        if vmax > vmin:
+            disk_img = (disk_img - vmin) * (255.0/(vmax - vmin))
+
+        processed_img = warp_tools.vips2numpy(disk_img.floor().cast("uchar"))
+
+        return processed_img
+
+    def _prep_slide_for_large_non_rigid_registration(self, slide_obj, max_img_dim,
+                                                     full_out_shape, mask, mask_bbox_xywh,
+                                                     vips_micro_reg_mask_zero, use_tiler,
+                                                     warp_full_img, updating_non_rigid,
+                                                     brightfield_processing_cls,
+                                                     brightfield_processing_kwargs,
+                                                     if_processing_cls,
+                                                     if_processing_kwargs):
+        """Scale, warp, and process a single slide for non-rigid registration
+
+        Does the per-slide work for `prep_images_for_large_non_rigid_registration`.
+
+        Returns
+        -------
+        warped_img : pyvips.Image, ndarray
+            Warped image to be used for non-rigid registration
+
+        processing_mask : pyvips.Image
+            Mask covering the slide in `warped_img`
+
+        """
+
+        # Get image to warp. Likely a larger image scaled down to specified shape #
+        src_img_shape_rc, src_M = warp_tools.get_src_img_shape_and_M(transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
+                                                                        transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
+                                                                        dst_shape_rc=full_out_shape,
+                                                                        M=slide_obj.M)
+
+        if max_img_dim is not None:
+            if mask is not None:
+                closest_img_levels = np.where(np.max(slide_obj.slide_dimensions_wh, axis=1) < np.max(src_img_shape_rc))[0]
+                if len(closest_img_levels) > 0:
+                    closest_img_level = closest_img_levels[0] - 1
+                else:
+                    closest_img_level = len(slide_obj.slide_dimensions_wh) - 1
+        else:
+            closest_img_level = 0
+
+        img_to_warp = self._thumbnail_to_shape(slide_obj, src_img_shape_rc, closest_img_level)
+
+        if updating_non_rigid:
+            dxdy = slide_obj.bk_dxdy
+        else:
+            dxdy = None
+
+        # Get mask
+        slide_mask = slide_obj._get_resized_rigid_mask(full_out_shape, mask_bbox_xywh, non_rigid=dxdy is not None)
+
+        if not use_tiler:
+            # Process image using same method for rigid registration #
+            # Bandjoin the image with its coverage mask and warp both in one
+            # call, so the coordinate map and displacement lookups are only
+            # computed once
+            temp_processing_mask = pyvips.Image.black(img_to_warp.width, img_to_warp.height).invert()
+            to_warp = img_to_warp.bandjoin(temp_processing_mask)
+            if slide_obj.bg_color is not None:
+                fused_bg_color = [*slide_obj.bg_color, 0]
+            else:
+                fused_bg_color = None
+
+            warped_combined = warp_tools.warp_img(img=to_warp, M=slide_obj.M,
+                bk_dxdy=dxdy,
+                transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
+                transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
+                out_shape_rc=full_out_shape,
+                bbox_xywh=mask_bbox_xywh,
+                bg_color=fused_bg_color)
+
+            unprocessed_warped_img = warped_combined.extract_band(0, n=img_to_warp.bands)
+
+            # Re-binarize the mask band, which was interpolated along with the image
+            processing_mask = (warped_combined.extract_band(img_to_warp.bands) >= 128).ifthenelse(255, 0)
+
+            if slide_obj.img_type == slide_tools.IHC_NAME:
+                processing_cls = brightfield_processing_cls
+                processing_kwargs = brightfield_processing_kwargs
+            else:
+                processing_cls = if_processing_cls
+                processing_kwargs = if_processing_kwargs
+
+            np_dtype = slide_tools.VIPS_FORMAT_NUMPY_DTYPE[unprocessed_warped_img.format]
+            img_gb = warp_tools.calc_memory_size_gb((unprocessed_warped_img.height, unprocessed_warped_img.width),
+                                                    unprocessed_warped_img.bands, np_dtype)
+            if img_gb > TILER_THRESH_GB:
+                # Too big to process as a single numpy array, so process
+                # one tile at a time
+                processed_img = self._process_image_tiled(unprocessed_warped_img,
+                                                          processing_cls, processing_kwargs,
+                                                          slide_obj, closest_img_level)
+            else:
+                unprocessed_warped_img = warp_tools.vips2numpy(unprocessed_warped_img)
+                processor = processing_cls(image=unprocessed_warped_img, src_f=slide_obj.src_f, level=closest_img_level, series=slide_obj.series)
+
+                try:
+                    processed_img = processor.process_image(**processing_kwargs)
+                except TypeError:
+                    # processor.process_image doesn't take kwargs
+                    processed_img = processor.process_image()
+                processed_img = preprocessing.maybe_rescale_to_u8(processed_img)
+
+            np_mask = warp_tools.vips2numpy(slide_mask)
+            processed_img[np_mask==0] = 0
+
+            # Normalize images using stats collected for rigid registration #
+            warped_img = preprocessing.norm_img_stats(processed_img, self.target_processing_stats, mask=slide_mask)
+            warped_img = preprocessing.maybe_rescale_to_u8(warped_img)
+
+        else:
+            if not warp_full_img:
+                warped_img = warp_tools.warp_img(img=img_to_warp, M=slide_obj.M,
+                            bk_dxdy=dxdy,
+                            transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
+                            transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
+                            out_shape_rc=full_out_shape,
+                            bbox_xywh=mask_bbox_xywh)
+            else:
+                warped_img = slide_obj.warp_slide(0, non_rigid=updating_non_rigid, crop=mask_bbox_xywh)
+
+        # Get mask #
+        if mask is not None:
+            slide_mask = vips_micro_reg_mask_zero.ifthenelse(0, slide_mask)
+
+        if use_tiler:
+            # Image isn't processed when tiling, so the warped rigid
+            # registration mask is the processing mask
+            processing_mask = slide_mask
+
+        return warped_img, processing_mask
+
     def prep_images_for_large_non_rigid_registration(self, max_img_dim,
                                                         brightfield_processing_cls,
                                                         brightfield_processing_kwargs,
@@ -2893,10 +3421,11 @@ class Valis(object):
 
         warp_full_img = max_img_dim is None
         if not warp_full_img:
-            all_max_dims = [np.any(np.max(slide_obj.slide_dimensions_wh, axis=1) >= max_img_dim) for slide_obj in self.slide_dict.values()]
-            if not np.all(all_max_dims):
-                img_maxes = [np.max(slide_obj.slide_dimensions_wh, axis=1)[0] for slide_obj in self.slide_dict.values()]
-                smallest_img_max = np.min(img_maxes)
+            # Level 0 is the largest level, so its dimensions determine
+            # whether an image is big enough
+            level_0_maxes = np.array([np.max(slide_obj.slide_dimensions_wh[0]) for slide_obj in self.slide_dict.values()])
+            if not np.all(level_0_maxes >= max_img_dim):
+                smallest_img_max = np.min(level_0_maxes)
                 msg = (f"Requested size of images for non-rigid registration was {max_img_dim}. "
                     f"However, not all images are this large. Setting `max_non_rigid_registartion_dim_px` to "
                     f"{smallest_img_max}, which is the largest dimension of the smallest image")
@@ -2905,12 +3434,15 @@ class Valis(object):
 
         ref_slide = self.get_ref_slide()
 
-        max_s = np.min(ref_slide.slide_dimensions_wh[0]/np.array(ref_slide.processed_img_shape_rc[::-1]))
+        # These scale factors are all scalars, so stick to plain Python
+        # arithmetic instead of allocating temporary arrays
+        max_s = min(ref_slide.slide_dimensions_wh[0][0]/ref_slide.processed_img_shape_rc[1],
+                    ref_slide.slide_dimensions_wh[0][1]/ref_slide.processed_img_shape_rc[0])
         if mask is None:
             if warp_full_img:
                 s = max_s
             else:
-                s = np.min(max_img_dim/np.array(ref_slide.processed_img_shape_rc))
+                s = max_img_dim/max(ref_slide.processed_img_shape_rc)
         else:
             # Determine how big image would have to be to get mask with maxmimum dimension = max_img_dim
             if isinstance(mask, pyvips.Image):
@@ -2918,19 +3450,22 @@ class Valis(object):
             else:
                 mask_shape_rc = np.array(mask.shape[0:2])
 
-            to_reg_mask_sxy = (mask_shape_rc/np.array(ref_slide.reg_img_shape_rc))[::-1]
-            if not np.all(to_reg_mask_sxy == 1):
+            to_reg_mask_sxy = (mask_shape_rc[1]/ref_slide.reg_img_shape_rc[1],
+                               mask_shape_rc[0]/ref_slide.reg_img_shape_rc[0])
+            if to_reg_mask_sxy != (1, 1):
                 # Resize just in case it's huge. Only need bounding box
                 reg_size_mask = warp_tools.resize_img(mask, ref_slide.reg_img_shape_rc, interp_method="nearest")
             else:
                 reg_size_mask = mask
             reg_size_mask_xy = warp_tools.mask2xy(reg_size_mask)
             to_reg_mask_bbox_xywh = list(warp_tools.xy2bbox(reg_size_mask_xy))
+            # reg_size_mask_xy is only the 4 bbox corners, so the scaled
+            # bbox below stays cheap to compute
             to_reg_mask_wh = np.round(to_reg_mask_bbox_xywh[2:]).astype(int)
             if warp_full_img:
                 s = max_s
             else:
-                s = np.min(max_img_dim/np.array(to_reg_mask_wh))
+                s = max_img_dim/max(to_reg_mask_wh)
 
         if s < max_s:
             full_out_shape = self.get_aligned_slide_shape(s)
@@ -2942,7 +3477,8 @@ class Valis(object):
             mask_bbox_xywh = None
         else:
             # If masking, the area will be smaller. Get bounding box
-            mask_sxy = (full_out_shape/mask_shape_rc)[::-1]
+            mask_sxy = (full_out_shape[1]/mask_shape_rc[1],
+                        full_out_shape[0]/mask_shape_rc[0])
             mask_bbox_xywh = list(warp_tools.xy2bbox(mask_sxy*reg_size_mask_xy))
             mask_bbox_xywh[2:] = np.round(mask_bbox_xywh[2:]).astype(int)
             out_shape = mask_bbox_xywh[2:][::-1]
@@ -2953,6 +3489,9 @@ class Valis(object):
                 vips_micro_reg_mask = mask
             vips_micro_reg_mask = warp_tools.resize_img(vips_micro_reg_mask, full_out_shape, interp_method="nearest")
             vips_micro_reg_mask = warp_tools.crop_img(img=vips_micro_reg_mask, xywh=mask_bbox_xywh)
+            # Bind the background test once so the same pipeline is shared
+            # everywhere the mask is applied, letting libvips cache it
+            vips_micro_reg_mask_zero = (vips_micro_reg_mask == 0)
 
         use_tiler = False
         if ref_slide.reader.metadata.bf_datatype is not None:
@@ -2961,9 +3500,11 @@ class Valis(object):
             # Assuming images not read by bio-formats are RGB read using from openslide or png, jpeg, etc...
             np_dtype = "uint8"
 
-        displacement_gb = self.size*warp_tools.calc_memory_size_gb(full_out_shape, 2, "float32")
-        processed_img_gb = self.size*warp_tools.calc_memory_size_gb(out_shape, 1, "uint8")
-        img_gb = self.size*warp_tools.calc_memory_size_gb(out_shape, ref_slide.reader.metadata.n_channels, np_dtype)
+        full_px = float(np.prod(full_out_shape))
+        out_px = float(np.prod(out_shape))
+        displacement_gb = self.size*full_px*2*np.dtype("float32").itemsize/(2**30)
+        processed_img_gb = self.size*out_px*1/(2**30)
+        img_gb = self.size*out_px*ref_slide.reader.metadata.n_channels*np.dtype(np_dtype).itemsize/(2**30)
 
         # Size of full displacement fields, all larger processed images, and an image that will be processed
         estimated_gb = img_gb + displacement_gb + processed_img_gb
@@ -2977,104 +3518,53 @@ class Valis(object):
         img_names_list = [None] * self.size
         img_f_list = [None] * self.size
 
-        print("\n======== Preparing images for non-rigid registraration\n")
-        for slide_obj in tqdm.tqdm(self.slide_dict.values()):
-
-            # Get image to warp. Likely a larger image scaled down to specified shape #
-            src_img_shape_rc, src_M = warp_tools.get_src_img_shape_and_M(transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
-                                                                            transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
-                                                                            dst_shape_rc=full_out_shape,
-                                                                            M=slide_obj.M)
-
-            if max_img_dim is not None:
-                if mask is not None:
-                    closest_img_levels = np.where(np.max(slide_obj.slide_dimensions_wh, axis=1) < np.max(src_img_shape_rc))[0]
-                    if len(closest_img_levels) > 0:
-                        closest_img_level = closest_img_levels[0] - 1
-                    else:
-                        closest_img_level = len(slide_obj.slide_dimensions_wh) - 1
-            else:
-                closest_img_level = 0
-
-            vips_level_img = slide_obj.slide2vips(closest_img_level)
-            img_to_warp = warp_tools.resize_img(vips_level_img, src_img_shape_rc)
-
-            if updating_non_rigid:
-                dxdy = slide_obj.bk_dxdy
-            else:
-                dxdy = None
-
-            # Get mask
-            temp_processing_mask = slide_obj.warp_img(slide_obj.rigid_reg_mask, non_rigid=dxdy is not None, crop=False, interp_method="nearest")
-            temp_processing_mask = warp_tools.numpy2vips(temp_processing_mask)
-            slide_mask = warp_tools.resize_img(temp_processing_mask, full_out_shape, interp_method="nearest")
-            if mask_bbox_xywh is not None:
-                slide_mask = warp_tools.crop_img(slide_mask, mask_bbox_xywh)
-
-            if not use_tiler:
-                # Process image using same method for rigid registration #
-                unprocessed_warped_img = warp_tools.warp_img(img=img_to_warp, M=slide_obj.M,
-                    bk_dxdy=dxdy,
-                    transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
-                    transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
-                    out_shape_rc=full_out_shape,
-                    bbox_xywh=mask_bbox_xywh,
-                    bg_color=slide_obj.bg_color)
-
-                unprocessed_warped_img = warp_tools.vips2numpy(unprocessed_warped_img)
-
-                temp_processing_mask = pyvips.Image.black(img_to_warp.width, img_to_warp.height).invert()
-                processing_mask = warp_tools.warp_img(img=temp_processing_mask, M=slide_obj.M,
-                    bk_dxdy=dxdy,
-                    transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
-                    transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
-                    out_shape_rc=full_out_shape,
-                    bbox_xywh=mask_bbox_xywh,
-                    interp_method="nearest")
-
-                if slide_obj.img_type == slide_tools.IHC_NAME:
-                    processing_cls = brightfield_processing_cls
-                    processing_kwargs = brightfield_processing_kwargs
-                else:
-                    processing_cls = if_processing_cls
-                    processing_kwargs = if_processing_kwargs
-
-                processor = processing_cls(image=unprocessed_warped_img, src_f=slide_obj.src_f, level=closest_img_level, series=slide_obj.series)
-
-                try:
-                    processed_img = processor.process_image(**processing_kwargs)
-                except TypeError:
-                    # processor.process_image doesn't take kwargs
-                    processed_img = processor.process_image()
-                processed_img = exposure.rescale_intensity(processed_img, out_range=(0, 255)).astype(np.uint8)
-
-                np_mask = warp_tools.vips2numpy(slide_mask)
-                processed_img[np_mask==0] = 0
-
-                # Normalize images using stats collected for rigid registration #
-                warped_img = preprocessing.norm_img_stats(processed_img, self.target_processing_stats, mask=slide_mask)
-                warped_img = exposure.rescale_intensity(warped_img, out_range=(0, 255)).astype(np.uint8)
+        if not use_tiler:
+            # Back the stack of processed images with an anonymous temp
+            # file, so peak memory doesn't grow with the number of slides.
+            # The file is unlinked on close, and the mapping keeps it alive
+            img_stack = np.memmap(tempfile.TemporaryFile(),
+                                  dtype=np.uint8, mode="w+",
+                                  shape=(self.size, int(out_shape[0]), int(out_shape[1])))
+        else:
+            img_stack = None
 
-            else:
-                if not warp_full_img:
-                    warped_img = warp_tools.warp_img(img=img_to_warp, M=slide_obj.M,
-                                bk_dxdy=dxdy,
-                                transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
-                                transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
-                                out_shape_rc=full_out_shape,
-                                bbox_xywh=mask_bbox_xywh)
-                else:
-                    warped_img = slide_obj.warp_slide(0, non_rigid=updating_non_rigid, crop=mask_bbox_xywh)
+        print("\n======== Preparing images for non-rigid registraration\n")
 
-            # Get mask #
-            if mask is not None:
-                slide_mask = (vips_micro_reg_mask==0).ifthenelse(0, slide_mask)
+        # Each slide is prepped independently and slotted by stack_idx,
+        # so spread the slides across threads
+        pbar = tqdm.tqdm(total=self.size)
+
+        def prep_one_slide(slide_obj):
+            warped_img, processing_mask = \
+                self._prep_slide_for_large_non_rigid_registration(slide_obj,
+                    max_img_dim=max_img_dim,
+                    full_out_shape=full_out_shape,
+                    mask=mask,
+                    mask_bbox_xywh=mask_bbox_xywh,
+                    vips_micro_reg_mask_zero=vips_micro_reg_mask_zero if mask is not None else None,
+                    use_tiler=use_tiler,
+                    warp_full_img=warp_full_img,
+                    updating_non_rigid=updating_non_rigid,
+                    brightfield_processing_cls=brightfield_processing_cls,
+                    brightfield_processing_kwargs=brightfield_processing_kwargs,
+                    if_processing_cls=if_processing_cls,
+                    if_processing_kwargs=if_processing_kwargs)
 
-            # Update lists
             img_f_list[slide_obj.stack_idx] = slide_obj.src_f
             img_names_list[slide_obj.stack_idx] = slide_obj.name
-            scaled_warped_img_list[slide_obj.stack_idx] = warped_img
+            if img_stack is not None:
+                img_stack[slide_obj.stack_idx] = warped_img
+                scaled_warped_img_list[slide_obj.stack_idx] = img_stack[slide_obj.stack_idx]
+            else:
+                scaled_warped_img_list[slide_obj.stack_idx] = warped_img
             scaled_mask_list[slide_obj.stack_idx] = processing_mask
+            pbar.update(1)
+
+        n_cpu = multiprocessing.cpu_count() - 1
+        with parallel_backend("threading", n_jobs=n_cpu):
+            Parallel()(delayed(prep_one_slide)(slide_obj) for
+                       slide_obj in self.slide_dict.values())
+        pbar.close()
 
 
         img_dict = {serial_non_rigid.IMG_LIST_KEY: scaled_warped_img_list,
@@ -3088,7 +3578,7 @@ class Valis(object):
             scaled_non_rigid_mask = warp_tools.resize_img(vips_nr_mask, full_out_shape, interp_method="nearest")
             if mask is not None:
                 scaled_non_rigid_mask = scaled_non_rigid_mask.extract_area(*mask_bbox_xywh)
-                scaled_non_rigid_mask = (vips_micro_reg_mask == 0).ifthenelse(0, scaled_non_rigid_mask)
+                scaled_non_rigid_mask = vips_micro_reg_mask_zero.ifthenelse(0, scaled_non_rigid_mask)
             if not use_tiler:
                 scaled_non_rigid_mask = warp_tools.vips2numpy(scaled_non_rigid_mask)
         else:
@@ -3129,7 +3619,7 @@ class Valis(object):
 
         self.create_non_rigid_reg_mask()
         non_rigid_reg_mask = ref_slide.non_rigid_reg_mask
-        cropped_mask_shape_rc = warp_tools.xy2bbox(warp_tools.mask2xy(non_rigid_reg_mask))[2:][::-1]
+        cropped_mask_shape_rc = warp_tools.mask_bbox(non_rigid_reg_mask)[2:][::-1]
 
         nr_on_scaled_img = self.max_processed_image_dim_px != self.max_non_rigid_registartion_dim_px or \
             (non_rigid_reg_mask is not None and np.any(cropped_mask_shape_rc != ref_slide.reg_img_shape_rc))
@@ -3199,19 +3689,35 @@ class Valis(object):
         warp_tools.save_img(overlap_img_fout, self.non_rigid_overlap_img, thumbnail_size=self.thumbnail_size)
 
         n_digits = len(str(self.size))
-        for slide_name, slide_obj in self.slide_dict.items():
+
+        def save_nr_qc_imgs(slide_obj):
+            slide_name = slide_obj.name
             img_save_id = str.zfill(str(slide_obj.stack_idx), n_digits)
             slide_nr_reg_obj = non_rigid_registrar.non_rigid_obj_dict[slide_name]
             slide_obj.bk_dxdy = slide_nr_reg_obj.bk_dxdy
             slide_obj.fwd_dxdy = slide_nr_reg_obj.fwd_dxdy
             slide_obj.nr_rigid_reg_img_f = os.path.join(self.non_rigid_dst_dir, img_save_id + "_" + slide_obj.name + ".png")
 
-            if not slide_obj.is_rgb:
-                img_to_warp = rigid_registrar.img_obj_dict[slide_name].image
+            if not slide_obj.is_rgb and not nr_on_scaled_img:
+                # registered_img is already the uncropped non-rigid warp of
+                # this image, so crop it instead of warping a second time
+                crop_method = slide_obj.get_crop_method(self.crop)
+                if crop_method is not False:
+                    if crop_method == CROP_REF:
+                        scaled_shape_rc = ref_slide.processed_img_shape_rc
+                    else:
+                        scaled_shape_rc = slide_obj.reg_img_shape_rc
+                    bbox_xywh, _ = slide_obj.get_crop_xywh(crop_method, scaled_shape_rc)
+                    warped_img = warp_tools.crop_img(slide_nr_reg_obj.registered_img, bbox_xywh)
+                else:
+                    warped_img = slide_nr_reg_obj.registered_img
             else:
-                img_to_warp = slide_obj.image
+                if not slide_obj.is_rgb:
+                    img_to_warp = rigid_registrar.img_obj_dict[slide_name].image
+                else:
+                    img_to_warp = slide_obj.image
 
-            warped_img = slide_obj.warp_img(img_to_warp, non_rigid=True, crop=self.crop)
+                warped_img = slide_obj.warp_img(img_to_warp, non_rigid=True, crop=self.crop)
             warp_tools.save_img(slide_obj.nr_rigid_reg_img_f, warped_img, thumbnail_size=self.thumbnail_size)
 
             # Draw displacements on image actually used in non-rigid. Might be higher resolution
@@ -3241,6 +3747,12 @@ class Valis(object):
             deform_img_f = os.path.join(self.deformation_field_dir, img_save_id + "_" + slide_obj.name + ".png")
             warp_tools.save_img(deform_img_f, thumbanil_deform_grid, thumbnail_size=self.thumbnail_size)
 
+        # Warping, drawing, and saving each slide's QC images is independent,
+        # so do it on a thread pool (pyvips and skimage release the GIL)
+        n_cpu = multiprocessing.cpu_count() - 1
+        with ThreadPoolExecutor(max_workers=n_cpu) as executor:
+            list(executor.map(save_nr_qc_imgs, self.slide_dict.values()))
+
         return non_rigid_registrar
 
     def measure_error(self):
@@ -3344,15 +3856,25 @@ class Valis(object):
                                                    prev_slide_obj.reg_img_shape_rc)
 
 
-            prev_kp_in_slide = prev_slide_obj.warp_xy(slide_obj.xy_in_prev,
-                                                     M=prev_T,
-                                                     pt_level= prev_slide_obj.processed_img_shape_rc,
-                                                     non_rigid=False)
-
-            current_kp_in_slide = slide_obj.warp_xy(slide_obj.xy_matched_to_prev,
-                                                    M=img_T,
-                                                    pt_level= slide_obj.processed_img_shape_rc,
-                                                    non_rigid=False)
+            # The original and rigid warps only differ by the matrix, so
+            # apply both matrices to each point set in one batched call.
+            # Unlike Slide.warp_xy, no crop shift is applied, but the shift
+            # is the same for both slides and so cancels out in calc_d
+            prev_kp_in_slide, prev_warped_rigid = \
+                warp_tools.warp_xy_multi_M(slide_obj.xy_in_prev,
+                    [prev_T, prev_slide_obj.M],
+                    transformation_src_shape_rc=prev_slide_obj.processed_img_shape_rc,
+                    transformation_dst_shape_rc=prev_slide_obj.reg_img_shape_rc,
+                    src_shape_rc=prev_slide_obj.processed_img_shape_rc,
+                    dst_shape_rc=prev_slide_obj.aligned_slide_shape_rc)
+
+            current_kp_in_slide, current_warped_rigid = \
+                warp_tools.warp_xy_multi_M(slide_obj.xy_matched_to_prev,
+                    [img_T, slide_obj.M],
+                    transformation_src_shape_rc=slide_obj.processed_img_shape_rc,
+                    transformation_dst_shape_rc=slide_obj.reg_img_shape_rc,
+                    src_shape_rc=slide_obj.processed_img_shape_rc,
+                    dst_shape_rc=slide_obj.aligned_slide_shape_rc)
 
             og_d = warp_tools.calc_d(prev_kp_in_slide, current_kp_in_slide)
 
@@ -3365,17 +3887,6 @@ class Valis(object):
             all_og_tre[i] = median_og_tre
 
 
-            prev_warped_rigid = prev_slide_obj.warp_xy(slide_obj.xy_in_prev,
-                                                       M=prev_slide_obj.M,
-                                                       pt_level= prev_slide_obj.processed_img_shape_rc,
-                                                       non_rigid=False)
-
-            current_warped_rigid = slide_obj.warp_xy(slide_obj.xy_matched_to_prev,
-                                                     M=slide_obj.M,
-                                                     pt_level= slide_obj.processed_img_shape_rc,
-                                                     non_rigid=False)
-
-
             rigid_d = warp_tools.calc_d(prev_warped_rigid, current_warped_rigid)
             rtre = rigid_d/ref_diagonal
             median_rigid_tre = np.median(rtre)
@@ -3603,10 +4114,10 @@ class Valis(object):
             pathlib.Path(self.data_dir).mkdir(exist_ok=True,  parents=True)
             f_out = os.path.join(self.data_dir, self.name + "_registrar.pickle")
             self.reg_f = f_out
-            pickle.dump(self, open(f_out, 'wb'))
+            self._dump_registrar(f_out)
 
             data_f_out = os.path.join(self.data_dir, self.name + "_summary.csv")
-            error_df.to_csv(data_f_out, index=False)
+            error_df.to_csv(data_f_out, index=False, float_format='%.6g', chunksize=4096)
         except Exception as e:
             valtils.print_warning(e)
             print(traceback.format_exc())
@@ -3625,6 +4136,21 @@ class Valis(object):
         self.rigid_registrar = None
         self.non_rigid_registrar = None
 
+        for slide_obj in self.slide_dict.values():
+            slide_obj._slide_mask_cache = {}
+
+    def _dump_registrar(self, dst_f):
+        """Pickle this object to `dst_f`
+
+        Uses the highest pickle protocol, which serializes the large
+        displacement arrays as single raw buffers instead of the byte
+        streams older protocols emit, and a large write buffer so the
+        multi-GB dump isn't chopped into small writes.
+
+        """
+        with open(dst_f, 'wb', buffering=8*1024*1024) as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
     def register_micro(self,  brightfield_processing_cls=DEFAULT_BRIGHTFIELD_CLASS,
                  brightfield_processing_kwargs=DEFAULT_BRIGHTFIELD_PROCESSING_ARGS,
                  if_processing_cls=DEFAULT_FLOURESCENCE_CLASS,
@@ -3757,9 +4283,43 @@ class Valis(object):
         pathlib.Path(self.micro_reg_dir).mkdir(exist_ok=True, parents=True)
         out_shape = full_out_shape_rc
         n_digits = len(str(self.size))
-        micro_reg_imgs = [None] * self.size
 
-        for slide_obj in self.slide_dict.values():
+        # One (size, H, W) block shared by all slides, rather than a list
+        # of per-slide arrays. All warped processed images have the same
+        # shape, which isn't known until the first warp completes, so the
+        # first worker to finish allocates it
+        micro_reg_imgs = None
+        micro_reg_imgs_lock = threading.Lock()
+
+        def _warp_and_save_micro(slide_obj):
+            if not slide_obj.is_rgb:
+                img_to_warp = slide_obj.processed_img
+            else:
+                img_to_warp = slide_obj.image
+
+            micro_reg_img = slide_obj.warp_img(img_to_warp, non_rigid=True, crop=self.crop)
+
+            img_save_id = str.zfill(str(slide_obj.stack_idx), n_digits)
+            thumb_format = getattr(self, "thumbnail_format", "png")
+            micro_fout = os.path.join(self.micro_reg_dir, f"{img_save_id}_{slide_obj.name}.{thumb_format}")
+            micro_thumb = self.create_thumbnail(micro_reg_img)
+            warp_tools.save_img(micro_fout, micro_thumb)
+
+            if not slide_obj.is_rgb:
+                # micro_reg_img is already the warped processed image, so
+                # don't repeat the same warp
+                processed_micro_reg_img = micro_reg_img
+            else:
+                processed_micro_reg_img = slide_obj.warp_img(slide_obj.processed_img)
+
+            nonlocal micro_reg_imgs
+            with micro_reg_imgs_lock:
+                if micro_reg_imgs is None:
+                    micro_reg_imgs = np.empty((self.size, *processed_micro_reg_img.shape),
+                                              dtype=processed_micro_reg_img.dtype)
+            micro_reg_imgs[slide_obj.stack_idx] = processed_micro_reg_img
+
+        def finalize_micro_slide(slide_obj):
 
             nr_obj = non_rigid_registrar.non_rigid_obj_dict[slide_obj.name]
             is_array = False
@@ -3771,24 +4331,38 @@ class Valis(object):
                 new_bk_dxdy = self.pad_displacement(new_bk_dxdy, full_out_shape_rc, mask_bbox_xywh)
                 new_fwd_dxdy = self.pad_displacement(new_fwd_dxdy, full_out_shape_rc, mask_bbox_xywh)
 
-            if not isinstance(slide_obj.bk_dxdy[0], pyvips.Image):
-                current_bk_dxdy = warp_tools.numpy2vips(np.dstack(slide_obj.bk_dxdy)).cast("float")
-                current_fwd_dxdy = warp_tools.numpy2vips(np.dstack(slide_obj.fwd_dxdy)).cast("float")
+            current_is_np = not isinstance(slide_obj.bk_dxdy[0], pyvips.Image)
+            if not write_dxdy and current_is_np and \
+               not isinstance(new_bk_dxdy, pyvips.Image):
+                current_bk_dxdy = np.asarray(slide_obj.bk_dxdy)
+                if current_bk_dxdy.shape[1:] == (int(out_shape[0]), int(out_shape[1])):
+                    # Both fields are in memory and already the right
+                    # size, so a parallel numba add beats round-tripping
+                    # them through pyvips
+                    slide_obj.bk_dxdy = warp_tools.add_dxdy(current_bk_dxdy, np.asarray(new_bk_dxdy))
+                    slide_obj.fwd_dxdy = warp_tools.add_dxdy(np.asarray(slide_obj.fwd_dxdy), np.asarray(new_fwd_dxdy))
+                    return _warp_and_save_micro(slide_obj)
+
+            if current_is_np:
+                # Wrap each band's buffer directly rather than paying for
+                # np.dstack's copy into a new (H, W, 2) array
+                bk_dxdy = slide_obj.bk_dxdy
+                fwd_dxdy = slide_obj.fwd_dxdy
+                current_bk_dxdy = warp_tools.numpy2vips(bk_dxdy[0]).bandjoin(warp_tools.numpy2vips(bk_dxdy[1])).cast("float")
+                current_fwd_dxdy = warp_tools.numpy2vips(fwd_dxdy[0]).bandjoin(warp_tools.numpy2vips(fwd_dxdy[1])).cast("float")
             else:
                 current_bk_dxdy = slide_obj.bk_dxdy
                 current_fwd_dxdy = slide_obj.fwd_dxdy
 
-            slide_sxy = (np.array(out_shape)/np.array([current_bk_dxdy.height, current_bk_dxdy.width]))[::-1]
-            if not np.all(slide_sxy == 1):
-                scaled_bk_dx = float(slide_sxy[0])*current_bk_dxdy[0]
-                scaled_bk_dy = float(slide_sxy[1])*current_bk_dxdy[1]
-                current_bk_dxdy = scaled_bk_dx.bandjoin(scaled_bk_dy)
-                current_bk_dxdy = warp_tools.resize_img(current_bk_dxdy, out_shape)
-
-                scaled_fwd_dx = float(slide_sxy[0])*current_fwd_dxdy[0]
-                scaled_fwd_dy = float(slide_sxy[1])*current_fwd_dxdy[1]
-                current_fwd_dxdy = scaled_fwd_dx.bandjoin(scaled_fwd_dy)
-                current_fwd_dxdy = warp_tools.resize_img(current_fwd_dxdy, out_shape)
+            slide_sxy = (out_shape[1]/current_bk_dxdy.width,
+                         out_shape[0]/current_bk_dxdy.height)
+            if slide_sxy != (1, 1):
+                # Multiplying by a 2 element list scales each band, so the
+                # rescale + resize stays one lazy pipeline, with no
+                # per-band intermediates to materialize
+                band_scaling = [float(slide_sxy[0]), float(slide_sxy[1])]
+                current_bk_dxdy = warp_tools.resize_img(current_bk_dxdy*band_scaling, out_shape)
+                current_fwd_dxdy = warp_tools.resize_img(current_fwd_dxdy*band_scaling, out_shape)
 
             updated_bk_dxdy = current_bk_dxdy + new_bk_dxdy
             updated_fwd_dxdy = current_fwd_dxdy + new_fwd_dxdy
@@ -3798,8 +4372,15 @@ class Valis(object):
                 updated_fwd_dxdy = warp_tools.vips2numpy(updated_fwd_dxdy)
 
             if not write_dxdy:
-                slide_obj.bk_dxdy = np.array([updated_bk_dxdy[..., 0], updated_bk_dxdy[..., 1]])
-                slide_obj.fwd_dxdy = np.array([updated_fwd_dxdy[..., 0], updated_fwd_dxdy[..., 1]])
+                if isinstance(updated_bk_dxdy, pyvips.Image):
+                    updated_bk_dxdy = warp_tools.vips2numpy(updated_bk_dxdy)
+                    updated_fwd_dxdy = warp_tools.vips2numpy(updated_fwd_dxdy)
+
+                # moveaxis returns a view, and the dxdy setter copies
+                # while packing anyway, so no (2, H, W) intermediate is
+                # allocated here
+                slide_obj.bk_dxdy = np.moveaxis(updated_bk_dxdy, -1, 0)
+                slide_obj.fwd_dxdy = np.moveaxis(updated_fwd_dxdy, -1, 0)
             else:
                 pathlib.Path(self.displacements_dir).mkdir(exist_ok=True, parents=True)
                 slide_obj.stored_dxdy = True
@@ -3812,26 +4393,44 @@ class Valis(object):
                 cropped_bk_dxdy = updated_bk_dxdy.extract_area(*mask_bbox_xywh)
                 cropped_fwd_dxdy = updated_fwd_dxdy.extract_area(*mask_bbox_xywh)
 
-                cropped_bk_dxdy.cast("float").tiffsave(slide_obj._bk_dxdy_f, compression="lzw", lossless=True, tile=True, bigtiff=True)
-                cropped_fwd_dxdy.cast("float").tiffsave(slide_obj._fwd_dxdy_f, compression="lzw", lossless=True, tile=True, bigtiff=True)
-
-            if not slide_obj.is_rgb:
-                img_to_warp = slide_obj.processed_img
-            else:
-                img_to_warp = slide_obj.image
-
-            micro_reg_img = slide_obj.warp_img(img_to_warp, non_rigid=True, crop=self.crop)
-
-
-            img_save_id = str.zfill(str(slide_obj.stack_idx), n_digits)
-            micro_fout = os.path.join(self.micro_reg_dir, f"{img_save_id}_{slide_obj.name}.png")
-            micro_thumb = self.create_thumbnail(micro_reg_img)
-            warp_tools.save_img(micro_fout, micro_thumb)
-
-            processed_micro_reg_img = slide_obj.warp_img(slide_obj.processed_img)
-            micro_reg_imgs[slide_obj.stack_idx] = processed_micro_reg_img
-
-        pickle.dump(self, open(self.reg_f, 'wb'))
+                # Quantize to int16 with a per-field scale, which halves
+                # the bytes written and decoded compared to float32. The
+                # largest displacement maps to 32767, so the precision
+                # loss is at most max_displacement/32767 pixels, far less
+                # than a pixel. The scales are pickled with the slide and
+                # undone when the fields are loaded
+                bk_scale = DXDY_QUANT_MAX/max(float(cropped_bk_dxdy.abs().max()), 1e-3)
+                fwd_scale = DXDY_QUANT_MAX/max(float(cropped_fwd_dxdy.abs().max()), 1e-3)
+                slide_obj._bk_dxdy_scale = bk_scale
+                slide_obj._fwd_dxdy_scale = fwd_scale
+                q_bk_dxdy = (cropped_bk_dxdy*bk_scale).rint().cast("short")
+                q_fwd_dxdy = (cropped_fwd_dxdy*fwd_scale).rint().cast("short")
+
+                if getattr(self, "_dxdy_use_memmap", False):
+                    # Uncompressed strips keep the pixel data contiguous,
+                    # which is what lets tifffile.memmap map it on reload
+                    save_kwargs = dict(compression="none", bigtiff=True)
+                else:
+                    save_kwargs = dict(compression="lzw", lossless=True, tile=True, bigtiff=True)
+
+                # The two fields are independent pipelines, so encode and
+                # write them concurrently. Both need to be on disk before
+                # this slide gets warped below, because warp_img reads the
+                # stored displacements back from these files
+                with ThreadPoolExecutor(max_workers=2) as io_pool:
+                    save_futures = [io_pool.submit(q_bk_dxdy.tiffsave, slide_obj._bk_dxdy_f, **save_kwargs),
+                                    io_pool.submit(q_fwd_dxdy.tiffsave, slide_obj._fwd_dxdy_f, **save_kwargs)]
+                for save_future in save_futures:
+                    save_future.result()
+
+            _warp_and_save_micro(slide_obj)
+
+        # Each slide's displacement composition, warping, and saving is
+        # independent, and the heavy lifting happens in libvips pipelines
+        # that release the GIL, so run them on a thread pool
+        n_cpu = multiprocessing.cpu_count() - 1
+        with ThreadPoolExecutor(max_workers=n_cpu) as executor:
+            list(executor.map(finalize_micro_slide, self.slide_dict.values()))
 
         micro_overlap = self.draw_overlap_img(micro_reg_imgs)
         self.micro_reg_overlap_img = micro_overlap
@@ -3841,7 +4440,13 @@ class Valis(object):
         print("\n==== Measuring error\n")
         error_df = self.measure_error()
         data_f_out = os.path.join(self.data_dir, self.name + "_summary.csv")
-        error_df.to_csv(data_f_out, index=False)
+        error_df.to_csv(data_f_out, index=False, float_format='%.6g', chunksize=4096)
+
+        # Pickle once, after all state (overlap image, error summary)
+        # has been updated, so the saved registrar is never stale
+        for slide_obj in self.slide_dict.values():
+            slide_obj._slide_mask_cache = {}
+        self._dump_registrar(self.reg_f)
 
         return non_rigid_registrar, error_df
 
@@ -3863,7 +4468,23 @@ class Valis(object):
 
         ref_slide = self.get_ref_slide()
 
-        if np.issubdtype(type(level), np.integer):
+        is_pyramid_level = bool(np.issubdtype(type(level), np.integer))
+
+        # Memoize, since this gets called once per slide in the warping
+        # loops. The reference shapes are part of the key so the cache
+        # self-invalidates if they change between registration stages
+        if not hasattr(self, "_aligned_shape_cache"):
+            self._aligned_shape_cache = {}
+        # level can be a pyramid level, a scalar scaling, or a per-axis
+        # scaling array, so flatten it for the key
+        cache_key = (tuple(np.ravel(level).tolist()), is_pyramid_level,
+                     tuple(int(d) for d in ref_slide.processed_img_shape_rc),
+                     tuple(int(d) for d in ref_slide.reg_img_shape_rc))
+        cached_shape_rc = self._aligned_shape_cache.get(cache_key)
+        if cached_shape_rc is not None:
+            return np.array(cached_shape_rc)
+
+        if is_pyramid_level:
             n_levels = len(ref_slide.slide_dimensions_wh)
             if level >= n_levels:
                 msg = (f"requested to scale transformation for pyramid level {level}, ",
@@ -3878,6 +4499,7 @@ class Valis(object):
             s_rc = level
 
         aligned_out_shape_rc = np.ceil(np.array(ref_slide.reg_img_shape_rc)*s_rc).astype(int)
+        self._aligned_shape_cache[cache_key] = tuple(int(d) for d in aligned_out_shape_rc)
 
         return aligned_out_shape_rc
 
@@ -3965,13 +4587,16 @@ class Valis(object):
         """
         pathlib.Path(dst_dir).mkdir(exist_ok=True, parents=True)
 
-        for slide_obj in tqdm.tqdm(self.slide_dict.values()):
+        pbar = tqdm.tqdm(total=self.size)
+
+        def save_one_slide(slide_obj):
 
             # if reference image, then skip and copy ref to folder instead?
             if(self.reference_img_f == slide_obj.src_f):
                 print("copying reference...")
                 shutil.copy2(self.reference_img_f, dst_dir)
-                continue
+                pbar.update(1)
+                return
 
             slide_cmap = None
             if colormap is not None:
@@ -3991,6 +4616,14 @@ class Valis(object):
                                           interp_method=interp_method,
                                           colormap=slide_cmap,
                                           tile_wh=tile_wh, compression=compression)
+            pbar.update(1)
+
+        # Each slide's warp + ome.tiff save is an independent libvips
+        # pipeline that releases the GIL, so save them on a thread pool
+        n_cpu = multiprocessing.cpu_count() - 1
+        with ThreadPoolExecutor(max_workers=n_cpu) as executor:
+            list(executor.map(save_one_slide, self.slide_dict.values()))
+        pbar.close()
 
     @valtils.deprecated_args(perceputally_uniform_channel_colors="colormap")
     def warp_and_merge_slides(self, dst_f=None, level=0, non_rigid=True,
@@ -4072,7 +4705,8 @@ class Valis(object):
             src_f_list = self.original_img_list
 
         all_channel_names = []
-        merged_slide = None
+        seen_channels = set()
+        slides_to_merge = []
 
         for f in src_f_list:
             slide_name = valtils.get_name(os.path.split(f)[1])
@@ -4087,8 +4721,10 @@ class Valis(object):
                 slide_channel_names = channel_name_dict_by_name[slide_obj.name]
 
                 if drop_duplicates:
+                    # Set membership keeps the uniqueness check O(1) per
+                    # channel; all_channel_names stays the ordered output
                     keep_idx = [idx for idx  in range(len(slide_channel_names)) if
-                                slide_channel_names[idx] not in all_channel_names]
+                                slide_channel_names[idx] not in seen_channels]
 
             else:
                 slide_channel_names = slide_obj.reader.metadata.channel_names
@@ -4103,12 +4739,45 @@ class Valis(object):
                     warped_slide = keep_channels[0].bandjoin(keep_channels[1:])
             print(f"merging {', '.join(slide_channel_names)}")
 
-            if merged_slide is None:
-                merged_slide = warped_slide
-            else:
-                merged_slide = merged_slide.bandjoin(warped_slide)
-
+            slides_to_merge.append(warped_slide)
             all_channel_names.extend(slide_channel_names)
+            seen_channels.update(slide_channel_names)
+
+        def join_bands(band_imgs):
+            if len(band_imgs) == 1:
+                return band_imgs[0]
+            return band_imgs[0].bandjoin(band_imgs[1:])
+
+        # If opted in, checkpoint groups of channels to disk-backed temp
+        # images so the final save doesn't have every slide's warp
+        # pipeline (readers, masks, displacement fields) open at once.
+        # Costs a second render of each pixel and uncompressed temp
+        # disk, so it's off unless _merge_checkpoint_nbands is set. The
+        # temp files are deleted when their images are garbage collected
+        checkpoint_nbands = getattr(self, "_merge_checkpoint_nbands", None)
+        n_total_bands = sum(img.bands for img in slides_to_merge)
+        if checkpoint_nbands is not None and n_total_bands > checkpoint_nbands:
+            checkpointed = []
+            group = []
+            group_bands = 0
+            for warped_slide in slides_to_merge:
+                group.append(warped_slide)
+                group_bands += warped_slide.bands
+                if group_bands >= checkpoint_nbands:
+                    disk_img = pyvips.Image.new_temp_file("%s.v")
+                    join_bands(group).write(disk_img)
+                    checkpointed.append(disk_img)
+                    group = []
+                    group_bands = 0
+            if len(group) > 0:
+                disk_img = pyvips.Image.new_temp_file("%s.v")
+                join_bands(group).write(disk_img)
+                checkpointed.append(disk_img)
+            slides_to_merge = checkpointed
+
+        # A single bandjoin keeps the operation graph flat, instead of the
+        # N-deep chain a left-fold of bandjoins would build
+        merged_slide = join_bands(slides_to_merge)
 
 
         if colormap is not None:
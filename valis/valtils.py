@@ -44,9 +44,13 @@ def sort_nicely(l):
     l.sort(key=alphanum_key)
 
 
+@functools.lru_cache(maxsize=1024)
 def get_name(f):
     """
     To get an object's name, remove image type extension from filename
+
+    Memoized, since the same filenames are looked up repeatedly when
+    building and accessing `slide_dict`.
     """
     if re.search("\.", f) is None:
         # Extension already removed
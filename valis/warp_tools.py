@@ -15,6 +15,8 @@ import numpy as np
 import weightedstats
 import warnings
 import pyvips
+import numba as nba
+from numba import prange
 from interpolation.splines import UCGrid, filter_cubic, eval_cubic
 import SimpleITK as sitk
 import shapely
@@ -142,14 +144,8 @@ def calc_memory_size_gb(shape, nchannels, np_dtype):
     """Estimate amount of space an image will take up, in Gb
     """
 
-    bitdepth = "".join(re.findall(r'\d+', np_dtype))
-    if len(bitdepth) > 0:
-        bitdepth = eval(bitdepth)
-    else:
-        bitdepth = 1
-
     n_px = nchannels*np.multiply(*shape)
-    gb = ((n_px*8)/bitdepth)/(2**30)
+    gb = n_px*np.dtype(np_dtype).itemsize/(2**30)
 
     return gb
 
@@ -356,13 +352,27 @@ def save_img(dst_f, img, thumbnail_size=None):
     else:
         out_img = vips_img
 
-    out_img.write_to_file(dst_f)
+    if dst_f.endswith(".tif") or dst_f.endswith(".tiff"):
+        # zstd compresses several times faster than PNG's DEFLATE, and
+        # tiled layout allows random-access reads later
+        out_img.tiffsave(dst_f, compression="zstd", tile=True,
+                         tile_width=256, tile_height=256)
+    elif dst_f.endswith(".jpg") or dst_f.endswith(".jpeg"):
+        # libjpeg-turbo encodes several times faster than PNG's DEFLATE
+        out_img.jpegsave(dst_f, Q=90)
+    else:
+        out_img.write_to_file(dst_f)
 
 
-def get_pts_in_bbox(xy, xywh):
+def get_pts_in_bbox_mask(xy, xywh):
     x0, y0 = xywh[0:2]
     x1, y1 = xywh[0:2] + xywh[2:]
-    in_bbox_idx = np.where((xy[:, 0] >= x0)  & (xy[:, 0] < x1) & (xy[:, 1] >= y0)  & (xy[:, 1] < y1)==True)[0]
+    in_bbox_mask = (xy[:, 0] >= x0) & (xy[:, 0] < x1) & (xy[:, 1] >= y0) & (xy[:, 1] < y1)
+    return in_bbox_mask
+
+
+def get_pts_in_bbox(xy, xywh):
+    in_bbox_idx = np.where(get_pts_in_bbox_mask(xy, xywh))[0]
     xy_in_bbox = xy[in_bbox_idx]
     return xy_in_bbox, in_bbox_idx
 
@@ -769,7 +779,9 @@ def _numpy2vips_pre_22(a):
         height, width = a.shape
         bands = 1
 
-    linear = a.reshape(width * height * bands)
+    # Zero-copy when `a` is C-contiguous: the vips image wraps the array's
+    # buffer, and pyvips keeps a reference so it outlives `a`
+    linear = np.ascontiguousarray(a).reshape(width * height * bands)
     vi = pyvips.Image.new_from_memory(linear.data, width, height, bands,
                                       dtype_to_format[str(a.dtype)])
     return vi
@@ -793,6 +805,9 @@ def _vips2numpy_pre_22(vi):
         'dpcomplex': np.complex128,
     }
 
+    # The array wraps the rendered buffer directly, with no extra copy.
+    # np.ndarray holds the buffer reference, so no separate copy is needed
+    # to keep it alive
     img = np.ndarray(buffer=vi.write_to_memory(),
                       dtype=format_to_dtype[vi.format],
                       shape=[vi.height, vi.width, vi.bands])
@@ -832,12 +847,124 @@ def vips2numpy(vi):
     return a
 
 
+@nba.njit(parallel=True)
+def warp_accumulate_mask(combo_mask, src_mask, inv_M):
+    """Accumulate a nearest-neighbor rigid warp of `src_mask` into `combo_mask`
+
+    Equivalent to warping `src_mask` with the inverse of `inv_M` and then
+    doing `combo_mask[warped > 0] += 1`, but without allocating the warped
+    mask or making separate compare and scatter passes. For each pixel in
+    `combo_mask`, the source position is found with `inv_M` and the count
+    is incremented if the source mask is positive there.
+
+    """
+    out_h, out_w = combo_mask.shape
+    src_h, src_w = src_mask.shape
+
+    m00 = inv_M[0, 0]
+    m01 = inv_M[0, 1]
+    m02 = inv_M[0, 2]
+    m10 = inv_M[1, 0]
+    m11 = inv_M[1, 1]
+    m12 = inv_M[1, 2]
+
+    for y in prange(out_h):
+        for x in range(out_w):
+            sx = int(round(m00*x + m01*y + m02))
+            sy = int(round(m10*x + m11*y + m12))
+            if 0 <= sx < src_w and 0 <= sy < src_h and src_mask[sy, sx] > 0:
+                combo_mask[y, x] += 1
+
+
+@nba.njit(fastmath=True)
+def add_dxdy(a, b):
+    """Add two displacement fields with shape (2, H, W)
+
+    Elementwise add for the common case where both fields are numpy
+    arrays of the same size, which skips wrapping them in pyvips just
+    to do a memory-bound addition. Not `parallel=True`, since it runs
+    inside register_micro's thread pool and concurrent entry into a
+    parallel numba kernel isn't safe on the workqueue threading layer.
+
+    """
+    out = np.empty_like(a)
+    n_bands, h, w = a.shape
+    for i in range(h):
+        for c in range(n_bands):
+            for j in range(w):
+                out[c, i, j] = a[c, i, j] + b[c, i, j]
+
+    return out
+
+
 def pad_img(img, padded_shape):
     padding_T = get_padding_matrix(img.shape[0:2], padded_shape)
     padded_img = warp_img(img, padding_T, out_shape_rc=padded_shape)
 
     return padded_img, padding_T
 
+def _warp_img_cv(img, warp_M, out_shape_rc, bbox_xywh, bg_color, interp_method):
+    """Affine warp a numpy array with cv2.warpAffine
+
+    Fast path for `warp_img` when there is no displacement field and the
+    image is a numpy array, since OpenCV's resampling is SIMD-vectorized.
+    Cropping is folded into the affine as a translation, so only the
+    cropped region is resampled.
+
+    Parameters
+    ----------
+    img : ndarray
+        Image to be warped
+
+    warp_M : ndarray
+        3x3 affine matrix, already scaled to apply to `img`
+
+    out_shape_rc : tuple of int
+        Shape of `img` after warping, before any cropping
+
+    bbox_xywh : tuple, optional
+        Bounding box to crop the warped image
+
+    bg_color : list
+        Background color
+
+    interp_method : str
+        Interpolation method
+
+    Returns
+    -------
+    warped : ndarray
+        Warped version of `img`
+
+    """
+
+    cv_interp = {"nearest": cv2.INTER_NEAREST,
+                 "bilinear": cv2.INTER_LINEAR,
+                 "bicubic": cv2.INTER_CUBIC}.get(interp_method, cv2.INTER_CUBIC)
+
+    # warp_M maps dst->src, like all transformation matrices here, so
+    # cv2.warpAffine needs WARP_INVERSE_MAP to treat it as the inverse
+    # map. This matches the vips path, which applies inv(warp_M).
+    # Cropping offsets the destination grid, so it folds in as a
+    # right-multiplied translation of the sampled coordinates
+    if bbox_xywh is not None:
+        x, y, w, h = [int(np.round(v)) for v in bbox_xywh]
+        crop_T = np.identity(3)
+        crop_T[0, 2] = x
+        crop_T[1, 2] = y
+        warp_M = warp_M @ crop_T
+        out_wh = (w, h)
+    else:
+        out_wh = (int(out_shape_rc[1]), int(out_shape_rc[0]))
+
+    warped = cv2.warpAffine(img, warp_M[:2, :], out_wh,
+                            flags=cv_interp | cv2.WARP_INVERSE_MAP,
+                            borderMode=cv2.BORDER_CONSTANT,
+                            borderValue=tuple(float(v) for v in bg_color))
+
+    return warped
+
+
 def warp_img(img, M=None, bk_dxdy=None, out_shape_rc=None,
              transformation_src_shape_rc=None,
              transformation_dst_shape_rc=None,
@@ -896,11 +1023,21 @@ def warp_img(img, M=None, bk_dxdy=None, out_shape_rc=None,
     """
 
     is_array = False
+    use_cv = False
     if not isinstance(img, pyvips.Image):
         is_array = True
-        img = numpy2vips(img)
-
-    src_shape_rc = np.array([img.height, img.width])
+        # Affine-only warps of small arrays can skip pyvips and use
+        # OpenCV's SIMD-vectorized warpAffine
+        n_channels = 1 if img.ndim == 2 else img.shape[2]
+        use_cv = M is not None and bk_dxdy is None and n_channels <= 4 and \
+            img.dtype in (np.uint8, np.uint16, np.float32, np.float64)
+        if not use_cv:
+            img = numpy2vips(img)
+
+    if isinstance(img, pyvips.Image):
+        src_shape_rc = np.array([img.height, img.width])
+    else:
+        src_shape_rc = np.array(img.shape[0:2])
     if transformation_src_shape_rc is None:
         transformation_src_shape_rc = src_shape_rc
 
@@ -958,7 +1095,11 @@ def warp_img(img, M=None, bk_dxdy=None, out_shape_rc=None,
 
     # Do transformations
     if bg_color is None:
-        bg_color = [0] * img.bands
+        if isinstance(img, pyvips.Image):
+            n_bands = img.bands
+        else:
+            n_bands = 1 if img.ndim == 2 else img.shape[2]
+        bg_color = [0] * n_bands
         bg_extender = pyvips.enums.Extend.BLACK
     else:
         bg_extender = pyvips.enums.Extend.BACKGROUND
@@ -980,6 +1121,10 @@ def warp_img(img, M=None, bk_dxdy=None, out_shape_rc=None,
         else:
             warp_M = M
 
+        if use_cv:
+            return _warp_img_cv(img, warp_M, out_shape_rc, bbox_xywh,
+                                bg_color, interp_method)
+
         tx, ty = warp_M[:2, 2]
         warp_M = np.linalg.inv(warp_M)
         vips_M = warp_M[:2, :2].reshape(-1).tolist()
@@ -2178,6 +2323,67 @@ def warp_xy(xy, M=None, transformation_src_shape_rc=None, transformation_dst_sha
     return warped_xy
 
 
+def warp_xy_multi_M(xy, M_list, transformation_src_shape_rc=None,
+                    transformation_dst_shape_rc=None,
+                    src_shape_rc=None, dst_shape_rc=None):
+    """Rigidly warp the same points with several transformation matrices
+
+    Stacks the matrices and applies them in a single einsum, sharing one
+    scaling-factor computation. Equivalent to calling `warp_xy` once per
+    matrix with the same shape arguments and no displacement fields.
+
+    Parameters
+    ----------
+    xy : ndarray
+        [P, 2] array of xy coordinates for P points
+
+    M_list : list of ndarray
+        List of N 3x3 affine transformation matrices
+
+    transformation_src_shape_rc : (int, int)
+        Shape of image that was used to find the transformations
+
+    transformation_dst_shape_rc : (int, int), optional
+        Shape of the image with shape `transformation_src_shape_rc` after warping
+
+    src_shape_rc : optional, (int, int)
+        Shape of the image from which the points originated
+
+    dst_shape_rc : optional, (int, int)
+        Shape of image (with shape `src_shape_rc`) after warping
+
+    Returns
+    -------
+    warped_xy_list : list of ndarray
+        [P, 2] array of warped xy coordinates for each matrix in `M_list`
+
+    """
+
+    src_sxy, dst_sxy, _, _ = get_warp_scaling_factors(transformation_src_shape_rc=transformation_src_shape_rc,
+                                                      transformation_dst_shape_rc=transformation_dst_shape_rc,
+                                                      src_shape_rc=src_shape_rc, dst_shape_rc=dst_shape_rc)
+
+    if src_sxy is not None:
+        in_src_xy = xy/src_sxy
+    else:
+        in_src_xy = xy
+
+    src_pts = np.hstack([in_src_xy, np.ones((len(in_src_xy), 1))])
+
+    # Matrices get inverted, as in warp_xy_rigid
+    batch_M = np.stack([np.linalg.inv(M) for M in M_list])
+    dst_pts = np.einsum('pj,nij->npi', src_pts, batch_M)
+
+    # rescale to homogeneous coordinates, avoiding division by zero
+    dst_pts[dst_pts[..., 2] == 0, 2] = np.finfo(float).eps
+    warped_xy = dst_pts[..., :2]/dst_pts[..., 2:3]
+
+    if dst_sxy is not None:
+        warped_xy = warped_xy*dst_sxy
+
+    return [warped_xy[i] for i in range(len(M_list))]
+
+
 def warp_xy_inv(xy, M=None, transformation_src_shape_rc=None, transformation_dst_shape_rc=None, src_shape_rc=None, dst_shape_rc=None, bk_dxdy=None, fwd_dxdy=None):
     """Warp points from registered coordinates to original coordinates
 
@@ -2586,21 +2792,45 @@ def get_inside_mask_idx(xy, mask):
     return inside_mask_idx
 
 
-def mask2xy(mask):
+def mask_bbox(mask):
+    """Get the bounding box of the positive region of `mask`
+
+    Uses axis-wise reductions, so only O(H + W) memory is needed, unlike
+    np.where, which allocates coordinates for every positive pixel.
+
+    Returns
+    -------
+    bbox_xywh : [4, ] array
+        (top left x, top left y, width, height) of the bounding box
+
+    """
+
     if mask.ndim > 2:
-        mask_y, mask_x = np.where(np.all(mask > 0, axis=2))
+        pos_px = np.all(mask > 0, axis=2)
     else:
-        mask_y, mask_x = np.where(mask > 0)
-    min_x = np.min(mask_x)
-    max_x = np.max(mask_x)
-    min_y = np.min(mask_y)
-    max_y = np.max(mask_y)
+        pos_px = mask > 0
+
+    pos_rows = np.any(pos_px, axis=1)
+    pos_cols = np.any(pos_px, axis=0)
+    if not pos_rows.any():
+        raise ValueError("mask has no positive pixels")
+
+    min_y = int(pos_rows.argmax())
+    max_y = int(len(pos_rows) - pos_rows[::-1].argmax()) - 1
+    min_x = int(pos_cols.argmax())
+    max_x = int(len(pos_cols) - pos_cols[::-1].argmax()) - 1
+
+    return np.array([min_x, min_y, max_x + 1 - min_x, max_y + 1 - min_y])
+
+
+def mask2xy(mask):
+    min_x, min_y, w, h = mask_bbox(mask)
 
     bbox = np.array([
         [min_x, min_y],
-        [max_x+1, min_y],
-        [max_x+1, max_y+1],
-        [min_x, max_y+1]
+        [min_x+w, min_y],
+        [min_x+w, min_y+h],
+        [min_x, min_y+h]
     ])
 
     return bbox